@@ -1,14 +1,10 @@
 from collections import defaultdict
-import pandas as pd
 import math, unidecode, re, operator, os
 import numpy as np
 from statistics import mean, median, stdev
-from matplotlib import pyplot as plt
-from scipy.cluster.hierarchy import dendrogram, linkage, fcluster, to_tree
-from scipy.spatial.distance import squareform
-from sklearn import manifold
-import seaborn as sns
-import networkx as nx
+
+#Plotting, clustering and spreadsheet packages are imported within the functions
+#which use them, so that processes which only score words import this module quickly
 
 #GENERAL AUXILIARY FUNCTIONS
 def dict_tuplelist(dic, sort=True, reverse=True):
@@ -106,6 +102,8 @@ def csv_to_dict(csvfile, header=True, sep=',', start=0, encoding='utf_8'):
 def xlsx_to_csv(excel_path, csv_path=None, sheet=None, 
                 sep=',', index=None, header=True):
     """Converts an Excel file to a CSV file"""
+    import pandas as pd
+
     if sheet != None:
         excel_file = pd.read_excel(excel_path, sheet_name=sheet)
     else:
@@ -183,6 +181,64 @@ def adaptation_surprisal(alignment, surprisal_dict, ngram_size=1, normalize=True
     else:
         return sum(values)
 
+def encode_alignments(alignments, ngram_size=1, correspondence_ids=None):
+    """Integer-codes the ngram correspondences of the alignments which are scored by 
+    adaptation_surprisal. Returns an array of the correspondence codes of all alignments
+    concatenated, an array of the number of correspondences in each alignment,
+    and the dictionary of (ngram, segment) correspondence codes"""
+    if correspondence_ids == None:
+        correspondence_ids = {}
+    
+    pad_n = ngram_size - 1
+    codes, lengths = [], []
+    for alignment in alignments:
+        if ngram_size > 1:
+            alignment = [('#', '#')]*pad_n + alignment + [('#', '#')]*pad_n
+        for i in range(pad_n, len(alignment)-pad_n):
+            seg1, seg2 = list(zip(*alignment[i:i+ngram_size]))
+            key = (seg1, seg2[0])
+            if key not in correspondence_ids:
+                correspondence_ids[key] = len(correspondence_ids)
+            codes.append(correspondence_ids[key])
+        lengths.append(len(alignment)-(2*pad_n))
+    
+    return np.array(codes, dtype=int), np.array(lengths, dtype=int), correspondence_ids
+
+def correspondence_surprisal(surprisal_dict, correspondence_ids):
+    """Returns an array of the surprisal values of the coded correspondences,
+    including the dictionary's default values for unseen correspondences"""
+    values = np.zeros(len(correspondence_ids))
+    for (seg1, seg2), code in correspondence_ids.items():
+        values[code] = surprisal_dict[seg1][seg2]
+    return values
+
+def batch_adaptation_surprisal(codes, lengths, values, normalize=True):
+    """Calculates the surprisal of a batch of integer-coded alignments (see encode_alignments)
+    from an array of correspondence surprisal values, with a single gather and reduction"""
+    alignment_index = np.repeat(np.arange(len(lengths)), lengths)
+    totals = np.bincount(alignment_index, weights=values[codes], minlength=len(lengths))
+    if normalize == True:
+        return totals / lengths
+    else:
+        return totals
+
+def empirical_p_values(scores, null_scores, greater=True):
+    """Returns the empirical p-values of the scores against a null distribution:
+    (number of null scores >= score (or <= score if greater == False) + 1) / (number of null scores + 1)
+    The null scores are sorted once and the counts found by binary search"""
+    scores = np.asarray(scores, dtype=float)
+    null_scores = np.asarray(null_scores, dtype=float)
+    
+    #NaN scores are neither greater nor less than any other score
+    null = np.sort(null_scores[~np.isnan(null_scores)])
+    if greater == True:
+        counts = len(null) - np.searchsorted(null, scores, side='left')
+    else:
+        counts = np.searchsorted(null, scores, side='right')
+    counts[np.isnan(scores)] = 0
+    
+    return (counts + 1) / (len(null_scores) + 1)
+
 def entropy(X):
     """X should be a dictionary with absolute counts"""
     total = sum(X.values())
@@ -216,32 +272,91 @@ def list_mostsimilar(item1, comp_group, dist_func, n=5, sim=True, return_=False,
         for item in sim_list[:n]:
             print(f'{item[0].name}: {round(item[1], 2)}')
 
-def distance_matrix(group, dist_func, sim=False, **kwargs):
-    #Initialize nxn distance matrix filled with zeros
-    mat = np.zeros((len(group),len(group)))
-    
-    #Calculate pairwise distances between items and add to matrix
-    for i in range(len(group)):
-        for j in range(i+1, len(group)):
-            dist = dist_func(group[i], group[j], **kwargs)
-            
-            #Convert similarities to distances
-            if sim == True:
-                dist = 1 - min(1, dist)
-                
-            mat[i][j] = dist
-            mat[j][i] = dist
-            
-    return mat
+def condensed_distance_matrix(group, dist_func=None, sim=False,
+                              batch_func=None, n_jobs=1, chunk_size=None,
+                              **kwargs):
+    """Returns the pairwise distances between items of the group as a condensed
+    distance vector (same ordering as scipy's squareform: (0,1), (0,2), ... (n-2,n-1))
+
+    dist_func : function of two items, called once per pair
+    batch_func : optional function taking two arrays of item indices (rows, cols)
+                 and returning an array of scores for all of those pairs at once;
+                 used instead of dist_func if provided
+    n_jobs : number of worker threads among which chunks of the condensed
+             index space are divided; only used with a batch_func which releases 
+             the GIL (e.g. NumPy array operations), as threads give no speedup 
+             for pure Python functions; dist_func is always called sequentially
+    chunk_size : number of pairs per chunk; by default the pairs are split
+                 evenly among the workers"""
+    assert (dist_func != None) or (batch_func != None)
+
+    #Row and column indices of each position in the condensed vector
+    n = len(group)
+    rows, cols = np.triu_indices(n, k=1)
+    dists = np.zeros(len(rows))
+    if len(dists) == 0:
+        return dists
+
+    def fill_chunk(start, end):
+        if batch_func != None:
+            dists[start:end] = batch_func(rows[start:end], cols[start:end], **kwargs)
+        else:
+            for k in range(start, end):
+                dists[k] = dist_func(group[rows[k]], group[cols[k]], **kwargs)
+
+    #Split the condensed index space into chunks
+    if batch_func == None:
+        n_jobs = 1
+    if chunk_size == None:
+        chunk_size = math.ceil(len(dists) / max(n_jobs, 1))
+    chunks = [(start, min(start+chunk_size, len(dists)))
+              for start in range(0, len(dists), chunk_size)]
+
+    #Fill each chunk of the vector, in parallel threads if more than one worker is specified
+    if n_jobs > 1 and len(chunks) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            for future in [executor.submit(fill_chunk, start, end) for start, end in chunks]:
+                future.result()
+    else:
+        for start, end in chunks:
+            fill_chunk(start, end)
 
+    #Convert similarities to distances
+    if sim == True:
+        dists = 1 - np.minimum(1, dists)
 
-def linkage_matrix(group, dist_func, sim=False, 
+    return dists
+
+
+def distance_matrix(group, dist_func=None, sim=False,
+                    batch_func=None, n_jobs=1, chunk_size=None,
+                    **kwargs):
+    """Returns the nxn distance matrix of the group,
+    built from its condensed distance vector"""
+    from scipy.spatial.distance import squareform
+
+    dists = condensed_distance_matrix(group, dist_func, sim,
+                                      batch_func=batch_func, n_jobs=n_jobs,
+                                      chunk_size=chunk_size,
+                                      **kwargs)
+    if len(group) < 2:
+        return np.zeros((len(group),len(group)))
+    return squareform(dists)
+
+
+def linkage_matrix(group, dist_func, sim=False,
                    method = 'average', metric="euclidean",
+                   batch_func=None, n_jobs=1, chunk_size=None,
                    **kwargs):
     """Methods: average, centroid, median, single, complete, ward, weighted
         See: https://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.linkage.html"""
-    mat = distance_matrix(group, dist_func, sim, **kwargs)
-    dists = squareform(mat)
+    from scipy.cluster.hierarchy import linkage
+
+    dists = condensed_distance_matrix(group, dist_func, sim,
+                                      batch_func=batch_func, n_jobs=n_jobs,
+                                      chunk_size=chunk_size,
+                                      **kwargs)
     lm = linkage(dists, method, metric)
     return lm
 
@@ -250,6 +365,8 @@ def cluster_items(group, labels,
                   dist_func, sim, cutoff,
                   method = 'average', metric='euclidean',
                   **kwargs):
+    from scipy.cluster.hierarchy import fcluster
+
     lm = linkage_matrix(group, dist_func, sim, method, metric, **kwargs)
     cluster_labels = fcluster(lm, cutoff, 'distance')
     clusters = defaultdict(lambda:[])
@@ -275,6 +392,10 @@ def draw_dendrogram(group, dist_func, title=None, sim=False, labels=None,
                     save_directory='',
                     return_newick=False,
                     **kwargs):
+    from matplotlib import pyplot as plt
+    import seaborn as sns
+    from scipy.cluster.hierarchy import dendrogram
+
     sns.set(font_scale=1.0)
     if len(group) >= 100:
         plt.figure(figsize=(20,20))
@@ -306,6 +427,8 @@ def getNewick(node, newick, parentdist, leaf_names):
         return newick
 
 def linkage2newick(linkage_matrix, leaf_labels):
+    from scipy.cluster.hierarchy import to_tree
+
     #Convert parentheses in labels to brackets, as parentheses are part of Newick format
     for i in range(len(leaf_labels)):
         leaf_labels[i] = re.sub("\(", "{", leaf_labels[i])
@@ -316,6 +439,8 @@ def linkage2newick(linkage_matrix, leaf_labels):
 
 def dm2coords(dm, dimensions=2):
     """Returns coordinate embeddings of an array of items from their distance matrix"""
+    from sklearn import manifold
+
     adist = np.array(dm)
     amax = np.amax(adist)
     adist /= amax
@@ -331,6 +456,9 @@ def plot_distances(group, dist_func=None, sim=False, dimensions=2, labels=None,
                    title=None, plotsize=None, invert_yaxis=False, invert_xaxis=False,
                    directory='',
                    **kwargs):   
+    from matplotlib import pyplot as plt
+    import seaborn as sns
+
     dm = distance_matrix(group, dist_func, sim, **kwargs)
     coords = dm2coords(dm, dimensions)
     sns.set(font_scale=1.0)
@@ -360,13 +488,12 @@ def plot_distances(group, dist_func=None, sim=False, dimensions=2, labels=None,
     plt.show()
 
 #%%
-from kneed import KneeLocator
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.metrics import silhouette_score
-from sklearn.preprocessing import StandardScaler
-
 def k_means_cluster(dm, k='elbow', n_init=10, max_iter=300, random_state=42, scaler=True, item_labels=None):
-    
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    from sklearn.preprocessing import StandardScaler
+    from kneed import KneeLocator
+
     kmeans_kwargs = {"init":"random",
                      "n_init":n_init,
                      "max_iter":max_iter,
@@ -426,7 +553,9 @@ def k_means_cluster(dm, k='elbow', n_init=10, max_iter=300, random_state=42, sca
         return labels
 
 def dbscan_cluster(dm, scaler=True, item_labels=None):
-    
+    from sklearn.cluster import DBSCAN
+    from sklearn.preprocessing import StandardScaler
+
     if scaler:
         scaler = StandardScaler()
         dm = scaler.fit_transform(dm)
@@ -464,6 +593,9 @@ def network_plot(group, labels,
 
     #warnings.filterwarnings("ignore", category=UserWarning)
     
+    from matplotlib import pyplot as plt
+    import networkx as nx
+
     #Determine the minimum number of edges per node to display
     #By default, take the square root of total number of network nodes
     #for spring networks, and the total number of network nodes for coordinate networks
@@ -621,11 +753,17 @@ def new_network_plot(group, labels,
 
     #warnings.filterwarnings("ignore", category=UserWarning)
     
+    from matplotlib import pyplot as plt
+    import networkx as nx
+    from scipy.spatial.distance import squareform
+    from scipy.cluster.hierarchy import linkage, fcluster
+
     #Create dictionary of node indices and their labels
     item_labels = {n:labels[n] for n in range(len(labels))}
     
     #Calculate initial coordinates for nodes from a distance matrix using MDS
-    dm = distance_matrix(group, dist_func, sim, **kwargs)
+    dists = condensed_distance_matrix(group, dist_func, sim, **kwargs)
+    dm = squareform(dists)
     
     #Distance dictionary
     dist_dict = {}
@@ -634,7 +772,6 @@ def new_network_plot(group, labels,
             dist_dict[(item_labels[i], item_labels[j])] = dm[i][j]
     
     #Get linkage matrix and hierarchical clustering of items
-    dists = squareform(dm)
     lm = linkage(dists, method='average', metric='euclidean')
     cluster_labels = fcluster(lm, cluster_threshold, 'distance')
     clusters = defaultdict(lambda:[])
@@ -834,11 +971,17 @@ def newer_network_plot(group, labels,
 
     #warnings.filterwarnings("ignore", category=UserWarning)
     
+    from matplotlib import pyplot as plt
+    import networkx as nx
+    from scipy.spatial.distance import squareform
+    from scipy.cluster.hierarchy import linkage, fcluster
+
     #Create dictionary of node indices and their labels
     item_labels = {n:labels[n] for n in range(len(labels))}
     
     #Calculate initial coordinates for nodes from a distance matrix using MDS
-    dm = distance_matrix(group, dist_func, sim, **kwargs)
+    dists = condensed_distance_matrix(group, dist_func, sim, **kwargs)
+    dm = squareform(dists)
     
     #Distance dictionary
     dist_dict = {}
@@ -847,7 +990,6 @@ def newer_network_plot(group, labels,
             dist_dict[(item_labels[i], item_labels[j])] = dm[i][j]
     
     #Get linkage matrix and hierarchical clustering of items
-    dists = squareform(dm)
     lm = linkage(dists, method='average', metric='euclidean')
     
     def get_clusters(lm, cutoff):
@@ -1059,7 +1201,8 @@ def k_means_network(dm, labels,
                  title=None, save_directory='',
                  scale_func=lambda x:x+0.5,
                  **kwargs):
-    
+    import networkx as nx
+
     #Create dictionary of node indices and their labels
     item_labels = {n:labels[n] for n in range(len(labels))}
     assert len(item_labels) == len(dm)
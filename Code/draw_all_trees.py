@@ -41,7 +41,7 @@ def draw_all_trees(family, newick_directory,
     #Dendrogram characteristics
     languages = list(family.languages.values()) 
     names = [lang.name for lang in languages]
-    concept_list = [c for c in concept_list if len(family.concepts[c]) > 1]
+    concept_list = [c for c in concept_list if len(family.concepts.get(c, {})) > 1]
     
     gold, none = False, False
     for cog in cognate_types:
@@ -1,4 +1,4 @@
-from auxiliary_functions import euclidean_dist, normalize_dict
+from auxiliary_functions import euclidean_dist, normalize_dict, empirical_p_values
 from word_evaluation import *
 from statistics import mean, stdev, StatisticsError
 import math, random
@@ -212,20 +212,16 @@ def Z_score_dist(lang1, lang2, eval_func, eval_sim,
         noncognate_scores = lang1.noncognate_thresholds[(lang2, eval_func)]
     else:
         noncognate_scores = PhonemeCorrDetector(lang1, lang2).noncognate_thresholds(eval_func, **kwargs)
-    nc_len = len(noncognate_scores)
         
     
     #Calculate the p-values for the synonymous word pairs against non-synonymous word pairs
-    if eval_sim == True:
-        p_values = {concept:[(len([nc_score for nc_score in noncognate_scores if nc_score >= score])+1) / (nc_len+1) 
-                             for score in scores[concept]] 
-                    for concept in scores}
-        
-        
-    else:
-        p_values = {concept:[(len([nc_score for nc_score in noncognate_scores if nc_score <= score])+1) / (nc_len+1) 
-                             for score in scores[concept]] 
-                    for concept in scores}
+    #(higher scores are more significant for similarity scores, lower scores for distances)
+    all_scores = [score for concept in scores for score in scores[concept]]
+    all_p_values = empirical_p_values(all_scores, noncognate_scores, greater=eval_sim).tolist()
+    p_values, start = {}, 0
+    for concept in scores:
+        p_values[concept] = all_p_values[start:start+len(scores[concept])]
+        start += len(scores[concept])
    
     #Exclude synonyms if specified
     if exclude_synonyms == True:
@@ -2,6 +2,11 @@ import os, re, itertools, copy, glob
 from statistics import mean
 from collections import defaultdict
 import math, bcubed, random
+import pandas as pd
+from matplotlib import pyplot as plt
+import seaborn as sns
+from scipy.cluster.hierarchy import dendrogram, linkage, fcluster, to_tree
+from scipy.spatial.distance import squareform
 from auxiliary_functions import *
 from pathlib import Path
 local_dir = Path(str(os.getcwd()))
@@ -51,11 +56,18 @@ class LexicalDataset:
         self.glottocodes = {}
         self.iso_codes = {}
         self.distance_matrices = {}
+        self.pmi_iterations = {}
         
-        #Concepts in dataset
-        self.concepts = defaultdict(lambda:defaultdict(lambda:[]))
-        self.cognate_sets = defaultdict(lambda:defaultdict(lambda:[]))
+        #Concepts in dataset: plain dictionaries, so that lookups of missing 
+        #concepts or languages cannot add entries missing from the reverse indexes
+        self.concepts = {}
+        self.cognate_sets = {}
         self.clustered_cognates = defaultdict(lambda:{})
+        
+        #Reverse indexes of the concepts and cognate sets in which each language has entries
+        self.language_concepts = {}
+        self.language_cognate_sets = {}
+        
         self.load_data(self.filepath)
         self.load_cognate_sets()
         self.mutual_coverage = self.calculate_mutual_coverage()
@@ -95,11 +107,14 @@ class LexicalDataset:
                                             lang_id=self.lang_ids[lang],
                                             loan_c=self.loan_c)
             for concept in self.languages[lang].vocabulary:
-                self.concepts[concept][lang].extend(self.languages[lang].vocabulary[concept])
+                self.concepts.setdefault(concept, {}).setdefault(lang, []).extend(self.languages[lang].vocabulary[concept])
+                self.language_concepts.setdefault(lang, set()).add(concept)
         
     
     def load_cognate_sets(self):
         """Creates vocabulary index sorted by cognate sets"""
+        #Transcriptions already added per cognate set and language, for fast duplicate checks
+        seen = defaultdict(lambda:set())
         for lang in self.languages:
             lang = self.languages[lang]
             for i in lang.data:
@@ -114,8 +129,10 @@ class LexicalDataset:
                 
                 #Don't add duplicate or empty entries
                 if transcription.strip() != '':
-                    if transcription not in self.cognate_sets[cognate_id][lang.name]:
-                        self.cognate_sets[cognate_id][lang.name].append(transcription)
+                    self.language_cognate_sets.setdefault(lang.name, set()).add(cognate_id)
+                    if transcription not in seen[(cognate_id, lang.name)]:
+                        seen[(cognate_id, lang.name)].add(transcription)
+                        self.cognate_sets.setdefault(cognate_id, {}).setdefault(lang.name, []).append(transcription)
 
     
     def write_vocab_index(self, output_file=None,
@@ -147,6 +164,18 @@ class LexicalDataset:
                 f.write('\n')
     
     
+    def concept_presence(self, concept_list=None):
+        """Returns a boolean matrix of whether each language (rows) 
+        has any entries for each concept (columns)"""
+        
+        #By default use the entire vocabulary if no specific concept list is given
+        if concept_list == None:
+            concept_list = self.concepts
+        
+        presence = [[concept in lang.vocabulary for concept in concept_list] 
+                    for lang in self.languages.values()]
+        return np.array(presence, dtype=bool).reshape(len(self.languages), len(concept_list))
+    
     def calculate_mutual_coverage(self, concept_list=None):
         """Calculate the mutual coverage and average mutual coverage (AMC)
         of the dataset on a particular wordlist"""
@@ -155,25 +184,19 @@ class LexicalDataset:
         if concept_list == None:
             concept_list = self.concepts
         
-        #Calculate mutual coverage
-        concept_counts = {concept:len([lang for lang in self.languages 
-                                       if concept in self.languages[lang].vocabulary]) 
-                          for concept in concept_list}
-        shared_concepts = [concept for concept in concept_counts
-                           if concept_counts[concept] == len(self.languages)]
+        #Calculate mutual coverage: the number of concepts present in all languages
+        presence = self.concept_presence(concept_list)
+        shared_concepts = set([concept for concept, shared in zip(concept_list, presence.all(axis=0)) 
+                               if shared == True])
         mutual_coverage = len(shared_concepts)
         
-        #Calculate average mutual coverage
-        mutual_coverages = {}
-        for lang_pair in itertools.product(self.languages.values(), self.languages.values()):
-            lang1, lang2 = lang_pair
-            if lang1 != lang2:
-                pair_mutual_coverage = len([concept for concept in concept_list 
-                                            if concept in lang1.vocabulary 
-                                            if concept in lang2.vocabulary])
-                mutual_coverages[lang_pair] = pair_mutual_coverage
-        avg_mutual_coverage = mean(mutual_coverages.values()) / len([c for c in concept_list 
-                                                                     if c in self.concepts])
+        #Calculate average mutual coverage from the number of concepts shared 
+        #by each pair of languages, all counted in one matrix product
+        presence = presence.astype(int)
+        pair_coverage = presence @ presence.T
+        mutual_coverages = pair_coverage[~np.eye(len(pair_coverage), dtype=bool)]
+        avg_mutual_coverage = mean(mutual_coverages.tolist()) / len([c for c in concept_list 
+                                                                      if c in self.concepts])
         
         return mutual_coverage, avg_mutual_coverage
                     
@@ -186,13 +209,30 @@ class LexicalDataset:
         if concept_list == None:
             concept_list = self.concepts
         
+        #Count the concepts shared by each pair of languages once; 
+        #the coverage of each pruned language is then subtracted from the total
+        lang_names = list(self.languages.keys())
+        presence = self.concept_presence(concept_list).astype(int)
+        pair_coverage = presence @ presence.T
+        np.fill_diagonal(pair_coverage, 0)
+        remaining = np.ones(len(lang_names), dtype=bool)
+        coverage_total = int(pair_coverage.sum())
+        
+        def avg_mutual_coverage():
+            n_langs = int(remaining.sum())
+            return coverage_total / (n_langs * (n_langs - 1)) / len([c for c in concept_list 
+                                                                     if c in self.concepts])
+        
         pruned = []
         start_n_langs = len(self.languages)
-        original_amc = self.calculate_mutual_coverage(concept_list)[1]
-        while self.calculate_mutual_coverage(concept_list)[1] < min_amc:
+        original_amc = avg_mutual_coverage()
+        while avg_mutual_coverage() < min_amc:
             smallest_lang = min(self.languages.keys(), 
                                 key=lambda x: len(self.languages[x].vocabulary))
             pruned.append((smallest_lang, len(self.languages[smallest_lang].vocabulary)))
+            i = lang_names.index(smallest_lang)
+            coverage_total -= 2 * int(pair_coverage[i][remaining].sum())
+            remaining[i] = False
             self.remove_languages([smallest_lang])
         
         self.mutual_coverage = self.calculate_mutual_coverage(concept_list)
@@ -208,14 +248,26 @@ class LexicalDataset:
             print(f'\tAMC increased from {round(original_amc, 2)} to {round(self.mutual_coverage[1], 2)}.')
     
     
-    def calculate_phoneme_pmi(self, output_file=None, **kwargs):
+    def calculate_phoneme_pmi(self, output_file=None, initial_pmi_file=None, **kwargs):
         """Calculates phoneme PMI for all language pairs in the dataset and saves
-        the results to file"""
+        the results to file. Language pairs with values in the initial PMI file
+        are recalculated starting from those values."""
         
         #Specify output file name if none is specified
         if output_file == None:
             output_file = f'{self.directory}{self.name}_phoneme_PMI.csv'
         
+        #Load previously calculated PMI values to start from, if provided
+        initial_pmi = defaultdict(lambda:defaultdict(lambda:defaultdict(lambda:0)))
+        if initial_pmi_file != None:
+            pmi_data = pd.read_csv(initial_pmi_file)
+            for lang1, phone1, lang2, phone2, pmi_value in zip(pmi_data['Language1'], pmi_data['Phone1'],
+                                                               pmi_data['Language2'], pmi_data['Phone2'],
+                                                               pmi_data['PMI']):
+                initial_pmi[(lang1, lang2)][phone1][phone2] = pmi_value
+                initial_pmi[(lang2, lang1)][phone2][phone1] = pmi_value
+            self.read_pmi_iterations(pmi_data)
+        
         l = list(self.languages.values())
         
         #Check whether phoneme PMI has been calculated already for this pair
@@ -224,33 +276,76 @@ class LexicalDataset:
         for pair in itertools.product(l, l):
             lang1, lang2 = pair
             if (lang2, lang1) not in checked:
+                pair_names = (lang1.name, lang2.name)
+                
+                if pair_names in initial_pmi:
+                    print(f'Recalculating phoneme PMI for {lang1.name} and {lang2.name}...')
+                    detector = PhonemeCorrDetector(lang1, lang2)
+                    pmi = detector.calc_phoneme_pmi(initial_pmi=initial_pmi[pair_names], **kwargs)
+                    
+                    #Report the number of iterations saved relative to the previous calculation
+                    if pair_names in self.pmi_iterations:
+                        previous = self.pmi_iterations[pair_names]
+                        saved = previous - detector.pmi_iterations
+                        print(f'\tConverged after {detector.pmi_iterations} iterations ({previous} previously, {saved} saved)')
+                    else:
+                        print(f'\tConverged after {detector.pmi_iterations} iterations')
+                    self.pmi_iterations[pair_names] = detector.pmi_iterations
                     
-                if len(lang1.phoneme_pmi[lang2]) == 0:
+                elif len(lang1.phoneme_pmi[lang2]) == 0:
                     print(f'Calculating phoneme PMI for {lang1.name} and {lang2.name}...')
-                    pmi = PhonemeCorrDetector(lang1, lang2).calc_phoneme_pmi(**kwargs)
+                    detector = PhonemeCorrDetector(lang1, lang2)
+                    pmi = detector.calc_phoneme_pmi(**kwargs)
+                    self.pmi_iterations[pair_names] = detector.pmi_iterations
+                
+                checked.append((lang1, lang2))
                 
         #Save calculated PMI values to file
+        self.write_phoneme_pmi(output_file)
+    
+    def write_phoneme_pmi(self, output_file=None):
+        """Writes the calculated phoneme PMI values of all language pairs in the dataset to file"""
+        
+        #Specify output file name if none is specified
+        if output_file == None:
+            output_file = f'{self.directory}{self.name}_phoneme_PMI.csv'
+        
+        l = list(self.languages.values())
         with open(output_file, 'w') as f:
-            f.write('Language1,Phone1,Language2,Phone2,PMI\n')
+            f.write('Language1,Phone1,Language2,Phone2,PMI,Iterations\n')
             checked = []
             for pair in itertools.product(l, l):
                 lang1, lang2 = pair
                 if (lang2, lang1) not in checked:
                 
-                    #Retrieve the precalculated values
+                    #Retrieve the precalculated values and the number of iterations 
+                    #needed to calculate them, if known
                     pmi = lang1.phoneme_pmi[lang2]
+                    iterations = self.pmi_iterations.get((lang1.name, lang2.name), '')
                         
                     #Save all segment pairs with non-zero PMI values to file
                     #Also skip extremely small decimals that are close to zero
                     for seg1 in pmi:
                         for seg2 in pmi[seg1]:
-                            if abs(pmi[seg1][seg2]) > lang1.phonemes[seg1] * lang2.phonemes[seg2]:
-                                f.write(f'{lang1.name},{seg1},{lang2.name},{seg2},{pmi[seg1][seg2]}\n')
+                            if abs(pmi[seg1][seg2]) > lang1.phonemes.get(seg1, 0) * lang2.phonemes.get(seg2, 0):
+                                f.write(f'{lang1.name},{seg1},{lang2.name},{seg2},{pmi[seg1][seg2]},{iterations}\n')
                     
                     checked.append((lang1, lang2))
     
-    def load_phoneme_pmi(self, pmi_file=None, excepted=[]):
-        """Loads pre-calculated phoneme PMI values from file"""
+    def read_pmi_iterations(self, pmi_data, overwrite=True):
+        """Records the number of iterations needed to calculate the PMI values of 
+        each language pair in a dataframe loaded from a PMI file, if included;
+        if overwrite == False, previously recorded numbers are kept"""
+        if 'Iterations' in pmi_data.columns:
+            pair_iterations = pmi_data[['Language1', 'Language2', 'Iterations']].dropna().drop_duplicates()
+            for lang1, lang2, iterations in zip(pair_iterations['Language1'], pair_iterations['Language2'],
+                                                pair_iterations['Iterations']):
+                if (overwrite == True) or ((lang1, lang2) not in self.pmi_iterations):
+                    self.pmi_iterations[(lang1, lang2)] = int(iterations)
+    
+    def load_phoneme_pmi(self, pmi_file=None, excepted=[], overwrite=True):
+        """Loads pre-calculated phoneme PMI values from file;
+        if overwrite == False, language pairs which already have PMI values keep them"""
         
         #Designate the default file name to search for if no alternative is provided
         if pmi_file == None:
@@ -266,21 +361,35 @@ class LexicalDataset:
             self.calculate_phoneme_pmi(output_file=pmi_file)
             pmi_data = pd.read_csv(pmi_file)
         
+        #Language pairs whose PMI values are kept
+        calculated = set()
+        if overwrite == False:
+            calculated = {(lang1, lang2) for lang1 in self.languages.values() 
+                          for lang2 in lang1.phoneme_pmi if len(lang1.phoneme_pmi[lang2]) > 0}
+        
         #Iterate through the dataframe and save the PMI values to the Language
         #class objects' phoneme_pmi attribute
+        loaded = set()
         for index, row in pmi_data.iterrows():
             try:
                 lang1 = self.languages[row['Language1']]
                 lang2 = self.languages[row['Language2']]
-                if (lang1 not in excepted) and (lang2 not in excepted):
+                if (lang1 not in excepted) and (lang2 not in excepted) and ((lang1, lang2) not in calculated):
                     phone1, phone2 = row['Phone1'], row['Phone2']
                     pmi_value = row['PMI']
                     lang1.phoneme_pmi[lang2][phone1][phone2] = pmi_value
                     lang2.phoneme_pmi[lang1][phone2][phone1] = pmi_value
+                    loaded.add((lang1, lang2))
             
             #Skip loaded PMI values for languages which are not in dataset
             except KeyError:
                 pass
+        self.read_pmi_iterations(pmi_data, overwrite=overwrite)
+        
+        #PMI tables were updated in place: mark word pair alignments based on them as outdated
+        for lang1, lang2 in loaded:
+            lang1.phoneme_pmi_versions[lang2] += 1
+            lang2.phoneme_pmi_versions[lang1] += 1
     
     
     def calculate_phoneme_surprisal(self, ngram_size=1, output_file=None, **kwargs):
@@ -298,12 +407,25 @@ class LexicalDataset:
         for lang1 in self.languages.values():
             for lang2 in self.languages.values():
                     
-                #If not, calculate it now
+                #If not, calculate it now, together with the reverse direction if 
+                #that has not been calculated either
                 if len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0:
                     print(f'Calculating phoneme surprisal for {lang1.name} and {lang2.name}...')
-                    phoneme_surprisal = PhonemeCorrDetector(lang1, lang2).calc_phoneme_surprisal(ngram_size=ngram_size, **kwargs)
+                    if (lang1 != lang2) and (len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0):
+                        phoneme_surprisal = PhonemeCorrDetector(lang1, lang2).calc_bidirectional_surprisal(ngram_size=ngram_size, **kwargs)
+                    else:
+                        phoneme_surprisal = PhonemeCorrDetector(lang1, lang2).calc_phoneme_surprisal(ngram_size=ngram_size, **kwargs)
                 
         #Save calculated surprisal values to file
+        self.write_phoneme_surprisal(ngram_size=ngram_size, output_file=output_file)
+    
+    def write_phoneme_surprisal(self, ngram_size=1, output_file=None):
+        """Writes the calculated phoneme surprisal values of all language pairs in the dataset to file"""
+        
+        #Specify output file name if none is specified
+        if output_file == None:
+            output_file = f'{self.directory}{self.name}_phoneme_surprisal_{ngram_size}gram.csv'
+        
         with open(output_file, 'w') as f:
             f.write('Language1,Phone1,Language2,Phone2,Surprisal,OOV_Smoothed\n')
             for lang1 in self.languages.values():
@@ -339,10 +461,11 @@ class LexicalDataset:
         try:
             surprisal_data = pd.read_csv(surprisal_file)
             
-        #If the file is not found, recalculate the surprisal values and save to 
-        #a file with the specified name
+        #If the file is not found, recalculate the surprisal values (and PMI values,
+        #if necessary) and save to a file with the specified name
         except FileNotFoundError:
-            self.calculate_phoneme_surprisal(output_file=surprisal_file)
+            self.correspondence_pipeline(ngram_sizes=[ngram_size], 
+                                         surprisal_files={ngram_size:surprisal_file})
             surprisal_data = pd.read_csv(surprisal_file)
         
         #Iterate through the dataframe and save the surprisal values to the Language
@@ -364,6 +487,13 @@ class LexicalDataset:
             except KeyError:
                 pass
     
+    def correspondence_pipeline(self, ngram_sizes=[1], pmi_file=None, surprisal_files=None, **kwargs):
+        """Calculates phoneme PMI and surprisal for all language pairs in the dataset 
+        in one pass with a CorrespondencePipeline, and saves the results to file"""
+        pipeline = CorrespondencePipeline(self, ngram_sizes=ngram_sizes, **kwargs)
+        pipeline.run(pmi_file=pmi_file, surprisal_files=surprisal_files)
+        return pipeline
+    
     def phonetic_diversity(self, ch_to_remove=[]):
         #diversity_scores = {}
         diversity_scores = defaultdict(lambda:[])
@@ -398,11 +528,11 @@ class LexicalDataset:
             
         words = [strip_ch(item[i], ['(', ')'])
                  for cognate_id in cognate_ids
-                 for item in self.cognate_sets[cognate_id].values()
+                 for item in self.cognate_sets.get(cognate_id, {}).values()
                  for i in range(len(item))]
         
         lang_labels = [key for cognate_id in cognate_ids
-                       for key in self.cognate_sets[cognate_id].keys()
+                       for key in self.cognate_sets.get(cognate_id, {}).keys()
                        for i in range(len(self.cognate_sets[cognate_id][key]))]
         labels = [f'{lang_labels[i]} /{words[i]}/' for i in range(len(words))]
         
@@ -434,7 +564,7 @@ class LexicalDataset:
                          method='average',
                          **kwargs):
         concept_list = [concept for concept in concept_list 
-                        if len(self.concepts[concept]) > 1]
+                        if len(self.concepts.get(concept, {})) > 1]
         clustered_cognates = {}
         for concept in sorted(concept_list):
             #print(f'Clustering words for "{concept}"...')
@@ -667,7 +797,10 @@ class LexicalDataset:
                         concept_list=None,
                         cluster_func=None, cluster_sim=None, cutoff=None, 
                         cognates='auto',
+                        condensed=False,
                         **kwargs):
+        """Returns the distance matrix of the dataset's languages;
+        if condensed == True, returns the condensed distance vector instead"""
         
         #Try to skip re-calculation of distance matrix by retrieving
         #a previously computed distance matrix by its code
@@ -679,7 +812,10 @@ class LexicalDataset:
         #doesn't yet account for concept_list ID
         
         if code in self.distance_matrices:
-            return self.distance_matrices[code]
+            dists = self.distance_matrices[code]
+            if condensed == True:
+                return dists
+            return squareform(dists)
         
         #Use all available concepts by default
         if concept_list == None:
@@ -687,7 +823,7 @@ class LexicalDataset:
                                    if len(self.concepts[concept]) > 1])
         else:
             concept_list = sorted([concept for concept in concept_list 
-                                   if len(self.concepts[concept]) > 1])
+                                   if len(self.concepts.get(concept, {})) > 1])
         
         if dist_func == Z_score_dist:
             cognates = 'none'
@@ -737,16 +873,18 @@ class LexicalDataset:
         languages = [self.languages[lang] for lang in self.languages]
         names = [lang.name for lang in languages]
         
-        #Compute distance matrix
-        dm = distance_matrix(group=languages, labels=names, 
-                             dist_func=dist_func, sim=sim,
-                             clustered_cognates=clustered_concepts,
-                             **kwargs)
+        #Compute condensed distance matrix
+        dists = condensed_distance_matrix(group=languages, labels=names, 
+                                          dist_func=dist_func, sim=sim,
+                                          clustered_cognates=clustered_concepts,
+                                          **kwargs)
         
-        #Store computed distance matrix
-        self.distance_matrices[code] = dm
+        #Store computed distance matrix in condensed form
+        self.distance_matrices[code] = dists
         
-        return dm
+        if condensed == True:
+            return dists
+        return squareform(dists)
     
     
     def linkage_matrix(self, dist_func, sim, 
@@ -755,12 +893,11 @@ class LexicalDataset:
                        cognates='auto',
                        method='average', metric='euclidean',
                        **kwargs):
-        dm = self.distance_matrix(dist_func, sim, 
-                                  concept_list, 
-                                  cluster_func, cluster_sim, cutoff, 
-                                  cognates, 
-                                  **kwargs)
-        dists = squareform(dm)
+        dists = self.distance_matrix(dist_func, sim, 
+                                     concept_list, 
+                                     cluster_func, cluster_sim, cutoff, 
+                                     cognates, condensed=True,
+                                     **kwargs)
         lm = linkage(dists, method, metric)
         return lm    
     
@@ -901,7 +1038,7 @@ class LexicalDataset:
                                    if len(self.concepts[concept]) > 1])
         else:
             concept_list = sorted([concept for concept in concept_list 
-                                   if len(self.concepts[concept]) > 1])
+                                   if len(self.concepts.get(concept, {})) > 1])
         
         if dist_func == Z_score_dist:
             cognates = 'none'
@@ -981,7 +1118,7 @@ class LexicalDataset:
                 cognate_sets.extend([c for c in self.cognate_sets if '_'.join(c.split('_')[:-1]) == concept])
         
         for cognate_set in cognate_sets:
-            lang_count = [lang for lang in language_list if lang.name in self.cognate_sets[cognate_set]]
+            lang_count = [lang for lang in language_list if lang.name in self.cognate_sets.get(cognate_set, {})]
             if len(lang_count) >= min_langs:
                 print(cognate_set)
                 for lang in lang_count:
@@ -997,43 +1134,71 @@ class LexicalDataset:
             del self.lang_ids[lang]
             del self.glottocodes[lang]
             del self.iso_codes[lang]
-        
-            for concept in self.concepts:
-                try:
-                    del self.concepts[concept][lang]
-                except KeyError:
-                    pass
             
-            for cognate_set in self.cognate_sets:
-                try:
-                    del self.cognate_sets[cognate_set][lang]
-                except KeyError:
-                    pass
-        
-        #Remove empty concepts and cognate sets
-        self.concepts = default_dict({concept:self.concepts[concept] 
-                         for concept in self.concepts 
-                         if len(self.concepts[concept]) > 0}, 
-                                     l=defaultdict(lambda:[]))
-        
-        self.cognate_sets = default_dict({cognate_set:self.cognate_sets[cognate_set] 
-                                          for cognate_set in self.cognate_sets 
-                                          if len(self.cognate_sets[cognate_set]) > 0}, 
-                                         l=defaultdict(lambda:[]))
+            #Remove the language's entries from the concepts and cognate sets 
+            #in which it occurs, and remove any of these which are left empty
+            for concept in self.language_concepts.pop(lang, set()):
+                if concept in self.concepts:
+                    self.concepts[concept].pop(lang, None)
+                    if len(self.concepts[concept]) == 0:
+                        del self.concepts[concept]
+            
+            for cognate_set in self.language_cognate_sets.pop(lang, set()):
+                if cognate_set in self.cognate_sets:
+                    self.cognate_sets[cognate_set].pop(lang, None)
+                    if len(self.cognate_sets[cognate_set]) == 0:
+                        del self.cognate_sets[cognate_set]
 
     
     def subset(self, new_name, include=None, exclude=None, **kwargs):
-        """Creates a subset of the existing dataset, including only select languages"""
-        
-        new_dataset = copy.deepcopy(self)
-        
-        #Remove languages not part of new subset
+        """Creates a subset of the existing dataset, including only select languages.
+        The subset shares the existing Language objects (with their vocabulary, 
+        inventories and correspondence tables) rather than copying them, and has 
+        its own language, concept and cognate set indexes and derived caches.
+        As the Language objects are shared, their family attribute still refers to 
+        the original dataset, e.g. for plot directories and the number of relatives"""
+        
+        #Determine the languages which are part of the new subset
         if include != None:
-            to_delete = [lang for lang in self.languages if lang not in include]
+            to_keep = [lang for lang in self.languages if lang in include]
         else:
             assert exclude != None
-            to_delete = exclude
-        new_dataset.remove_languages(to_delete)
+            to_keep = [lang for lang in self.languages if lang not in exclude]
+        keep = set(to_keep)
+        
+        def index_subset(index):
+            """Returns a copy of a concept or cognate set index restricted to the 
+            languages of the subset, without empty concepts or cognate sets; 
+            entry lists are copied so that adding data to the subset leaves 
+            the original dataset unchanged"""
+            new_index = {}
+            for key in index:
+                entries = {}
+                for lang in index[key]:
+                    if lang in keep:
+                        entries[lang] = list(index[key][lang])
+                if len(entries) > 0:
+                    new_index[key] = entries
+            return new_index
+        
+        #Copy the dataset's attributes, then replace the language-specific 
+        #indexes and caches with the subset's own
+        new_dataset = copy.copy(self)
+        new_dataset.languages = {lang:self.languages[lang] for lang in to_keep}
+        new_dataset.lang_ids = {lang:self.lang_ids[lang] for lang in to_keep}
+        new_dataset.glottocodes = {lang:self.glottocodes[lang] for lang in to_keep}
+        new_dataset.iso_codes = {lang:self.iso_codes[lang] for lang in to_keep}
+        new_dataset.concepts = index_subset(self.concepts)
+        new_dataset.cognate_sets = index_subset(self.cognate_sets)
+        new_dataset.language_concepts = {}
+        new_dataset.language_cognate_sets = {}
+        for lang in to_keep:
+            new_dataset.language_concepts[lang] = set(self.language_concepts.get(lang, set()))
+            new_dataset.language_cognate_sets[lang] = set(self.language_cognate_sets.get(lang, set()))
+        new_dataset.clustered_cognates = defaultdict(lambda:{})
+        new_dataset.distance_matrices = {}
+        new_dataset.pmi_iterations = {pair:self.pmi_iterations[pair] for pair in self.pmi_iterations
+                                      if (pair[0] in keep) and (pair[1] in keep)}
         
         #Assign the new name and any other specified attributes
         new_dataset.name = new_name
@@ -1056,6 +1221,94 @@ class LexicalDataset:
         
         return s
 
+#%%
+class CorrespondencePipeline:
+    """Calculates phoneme PMI and phoneme surprisal of one or more ngram sizes for all
+    language pairs of a dataset. The language pairs are processed one after another: 
+    for each, the pair's wordlists and PMI alignments are built once and surprisal is 
+    estimated in both directions from them; the tables are then saved together, PMI 
+    only if it was recalculated for any pair"""
+    
+    def __init__(self, dataset, ngram_sizes=[1], 
+                 radius=2, max_iterations=10, p_threshold=0.1, seed=1):
+        self.dataset = dataset
+        self.ngram_sizes = ngram_sizes
+        self.radius = radius
+        self.max_iterations = max_iterations
+        self.p_threshold = p_threshold
+        self.seed = seed
+    
+    def language_pairs(self):
+        """Returns each pair of languages in the dataset once, including each language with itself"""
+        l = list(self.dataset.languages.values())
+        return [(l[i], l[j]) for i in range(len(l)) for j in range(i, len(l))]
+    
+    def process_pair(self, lang1, lang2):
+        """Calculates any missing phoneme PMI and surprisal values of the language pair;
+        returns True if phoneme PMI was recalculated"""
+        kwargs = {'radius':self.radius, 'max_iterations':self.max_iterations, 
+                  'p_threshold':self.p_threshold, 'seed':self.seed}
+        detector = PhonemeCorrDetector(lang1, lang2)
+        recalculated_pmi = len(lang1.phoneme_pmi[lang2]) == 0
+        if recalculated_pmi == True:
+            detector.calc_phoneme_pmi(**kwargs)
+            self.dataset.pmi_iterations[(lang1.name, lang2.name)] = detector.pmi_iterations
+        
+        alignments = None
+        for ngram_size in self.ngram_sizes:
+            missing_l1l2 = len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0
+            missing_l2l1 = len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0
+            
+            #Align the word pairs for the first ngram size which needs them
+            if (alignments == None) and (missing_l1l2 or missing_l2l1):
+                alignments = detector.surprisal_alignments(**kwargs)
+            
+            if missing_l1l2 and missing_l2l1 and (lang1 != lang2):
+                detector.calc_bidirectional_surprisal(ngram_size=ngram_size, alignments=alignments, **kwargs)
+            elif missing_l1l2:
+                detector.calc_phoneme_surprisal(ngram_size=ngram_size, alignments=alignments, **kwargs)
+            elif missing_l2l1:
+                #Estimate the L2-->L1 direction alone from the reversed alignments
+                same_meaning_alignments, diff_meaning_alignments = alignments
+                reversed_pairs = [(pair[1], pair[0]) for pair in detector.same_meaning]
+                results = detector.fit_phoneme_surprisal([(lang2, lang1, reversed_pairs,
+                                                           [reverse_alignment(alignment) for alignment in same_meaning_alignments],
+                                                           [reverse_alignment(alignment) for alignment in diff_meaning_alignments])],
+                                                         max_iterations=self.max_iterations,
+                                                         p_threshold=self.p_threshold,
+                                                         ngram_size=ngram_size)[0]
+                lang2.phoneme_surprisal[(lang1, ngram_size)] = results
+        
+        return recalculated_pmi
+    
+    def run(self, pmi_file=None, surprisal_files=None):
+        """Processes all language pairs and saves the surprisal values to file, 
+        as well as the PMI values if any were recalculated.
+        surprisal_files : None, or dictionary of output file names keyed by ngram size"""
+        
+        #Start from previously saved PMI values if available, 
+        #for language pairs without PMI values already calculated or loaded
+        if pmi_file == None:
+            pmi_file = f'{self.dataset.directory}{self.dataset.name}_phoneme_PMI.csv'
+        if os.path.exists(pmi_file):
+            self.dataset.load_phoneme_pmi(pmi_file, overwrite=False)
+        
+        recalculated_pmi = False
+        for lang1, lang2 in self.language_pairs():
+            print(f'Calculating phoneme correspondences for {lang1.name} and {lang2.name}...')
+            if self.process_pair(lang1, lang2) == True:
+                recalculated_pmi = True
+        
+        #Save the surprisal tables, and the PMI table only if any values were recalculated
+        if surprisal_files == None:
+            surprisal_files = {}
+        if recalculated_pmi == True:
+            self.dataset.write_phoneme_pmi(pmi_file)
+        for ngram_size in self.ngram_sizes:
+            self.dataset.write_phoneme_surprisal(ngram_size=ngram_size, 
+                                                 output_file=surprisal_files.get(ngram_size, None))
+        
+
 #%%
 class Language(LexicalDataset):
     def __init__(self, name, data, 
@@ -1093,6 +1346,13 @@ class Language(LexicalDataset):
         self.trigrams = defaultdict(lambda:0)
         self.ngrams = defaultdict(lambda:defaultdict(lambda:0))
         self.gappy_trigrams = defaultdict(lambda:0)
+        self.segment_ids = {}
+        self.bigram_counts = None
+        self.kn_continuation_probs = None
+        self.kn_history_totals = None
+        self.kn_history_types = None
+        self.trigram_table = None
+        self.gappy_trigram_table = None
         self.info_contents = {}
         
         #Lexical inventory
@@ -1102,6 +1362,8 @@ class Language(LexicalDataset):
         
         self.create_vocabulary()
         self.create_phoneme_inventory()
+        self.create_bigram_tables()
+        self.create_infocontent_tables()
         self.check_affricates()
         
         self.phoneme_entropy = entropy(self.phonemes)
@@ -1109,6 +1371,7 @@ class Language(LexicalDataset):
         #Comparison with other languages
         self.phoneme_correspondences = defaultdict(lambda:defaultdict(lambda:0))
         self.phoneme_pmi = defaultdict(lambda:defaultdict(lambda:defaultdict(lambda:0)))
+        self.phoneme_pmi_versions = defaultdict(lambda:0)
         self.phoneme_surprisal = defaultdict(lambda:defaultdict(lambda:defaultdict(lambda:-self.phoneme_entropy)))
         self.detected_cognates = defaultdict(lambda:[])
         self.detected_noncognates = defaultdict(lambda:[])
@@ -1118,14 +1381,21 @@ class Language(LexicalDataset):
         #Remove stress and tone diacritics from segmented words; syllabic diacritics (above and below); spaces
         diacritics_to_remove = list(suprasegmental_diacritics) + ['̩', '̍', ' ']
         
-        for i in self.data:
+        #Segment all IPA forms in a single batch
+        segmented_forms = segment_words([self.data[i][self.ipa_c] for i in self.data], 
+                                        remove_ch=diacritics_to_remove)
+        
+        #Entries already added per concept, for fast duplicate checks
+        seen = defaultdict(lambda:set())
+        for i, segments in zip(self.data, segmented_forms):
             entry = self.data[i]
             concept = entry[self.concept_c]
             orthography = entry[self.orthography_c]
             ipa = entry[self.ipa_c]
-            segments = segment_word(ipa, remove_ch=diacritics_to_remove)
             if len(segments) > 0:
-                if [orthography, ipa, segments] not in self.vocabulary[concept]:
+                key = (orthography, ipa, tuple(segments))
+                if key not in seen[concept]:
+                    seen[concept].add(key)
                     self.vocabulary[concept].append([orthography, ipa, segments])
                 loan = entry[self.loan_c]
             
@@ -1162,6 +1432,9 @@ class Language(LexicalDataset):
         self.ngrams[2] = self.bigrams
         self.ngrams[3] = self.trigrams
         
+        #Assign integer IDs to phonemes, the word boundary and the gap symbol
+        self.segment_ids = {seg:i for i, seg in enumerate(list(self.phonemes.keys()) + ['#', 'X'])}
+        
         #Normalize counts
         total_tokens = sum(self.phonemes.values())
         for phoneme in self.phonemes:
@@ -1243,73 +1516,186 @@ class Language(LexicalDataset):
                     print(f'Warning! Both /{lig}/ and /{double}/ are in {self.name} transcriptions!')
     
     
-    def calculate_infocontent(self, word, segmented=False):
+    def encode_segments(self, segments):
+        """Returns an integer array of the segment IDs of a list of segments;
+        segments outside of the language's inventory share a single unknown ID"""
+        unk_id = len(self.segment_ids)
+        return np.array([self.segment_ids.get(seg, unk_id) for seg in segments], dtype=np.int64)
+    
+    
+    def trigram_codes(self, seg1, seg2, seg3):
+        """Returns integer codes for trigrams of segment IDs (arrays or integers)"""
+        base = len(self.segment_ids) + 1
+        return (seg1 * base + seg2) * base + seg3
+    
+    
+    def trigram_counts(self, table, codes):
+        """Looks up the counts of an array of trigram codes in a (sorted codes, counts) 
+        table; unattested trigrams have count 0"""
+        table_codes, table_counts = table
+        if len(table_codes) == 0:
+            return np.zeros(len(codes), dtype=np.int64)
+        indices = np.searchsorted(table_codes, codes)
+        indices = np.minimum(indices, len(table_codes)-1)
+        found = table_codes[indices] == codes
+        return np.where(found, table_counts[indices], 0)
+    
+    
+    def create_infocontent_tables(self):
+        """Encodes the trigram and gappy trigram counts as sorted arrays of 
+        integer trigram codes and precomputes the information content of each 
+        segment of each vocabulary entry"""
+        #Create trigram count tables from counts of attested trigrams
+        for table_name, ngrams in [('trigram_table', self.trigrams), 
+                                   ('gappy_trigram_table', self.gappy_trigrams)]:
+            attested = [ngram for ngram in ngrams if ngrams[ngram] > 0]
+            codes = self.trigram_codes(*[self.encode_segments([ngram[k] for ngram in attested]) 
+                                         for k in range(3)])
+            counts = np.array([ngrams[ngram] for ngram in attested], dtype=np.int64)
+            order = np.argsort(codes)
+            setattr(self, table_name, (codes[order], counts[order]))
+        
+        #Calculate information content of all vocabulary entries in one pass
+        words = {}
+        for concept in self.vocabulary:
+            for entry in self.vocabulary[concept]:
+                words[''.join(entry[2])] = entry[2]
+        if len(words) > 0:
+            info_content = self.infocontent_array(list(words.values()))
+            boundaries = np.cumsum([len(segments) for segments in words.values()])[:-1]
+            for joined, word_info_content in zip(words.keys(), np.split(info_content, boundaries)):
+                self.info_contents[joined] = word_info_content
+    
+    
+    def infocontent_array(self, segmented_words):
+        """Returns the information content of every segment of a list of 
+        segmented words, concatenated into a single float array"""
+        #Pad each word and concatenate the segment IDs of all words
+        padded = np.concatenate([self.encode_segments(['#', '#'] + segments + ['#', '#']) 
+                                 for segments in segmented_words])
+        
+        #Positions of the non-padding segments within the concatenated array
+        centers = np.concatenate([np.arange(2, len(segments)+2) 
+                                  for segments in segmented_words]).astype(np.int64)
+        offsets = np.cumsum([0] + [len(segments)+4 for segments in segmented_words][:-1])
+        centers += np.repeat(offsets, [len(segments) for segments in segmented_words])
+        
+        #Count attested contexts of each segment: 
+        #trigrams including the segment, and gappy trigrams excluding it
+        s1, s2, s3, s4, s5 = [padded[centers+k] for k in range(-2, 3)]
+        gap = self.segment_ids['X']
+        trigram_counts = (self.trigram_counts(self.trigram_table, self.trigram_codes(s1, s2, s3)) 
+                          + self.trigram_counts(self.trigram_table, self.trigram_codes(s2, s3, s4))
+                          + self.trigram_counts(self.trigram_table, self.trigram_codes(s3, s4, s5)))
+        gappy_counts = (self.trigram_counts(self.gappy_trigram_table, self.trigram_codes(s1, s2, gap)) 
+                        + self.trigram_counts(self.gappy_trigram_table, self.trigram_codes(s2, gap, s4))
+                        + self.trigram_counts(self.gappy_trigram_table, self.trigram_codes(gap, s4, s5)))
+        
+        if (trigram_counts == 0).any() or (gappy_counts == 0).any():
+            raise ValueError('Information content cannot be calculated for segments in unattested contexts!')
+        
+        return -np.log(trigram_counts/gappy_counts) / math.log(2)
+    
+    
+    def infocontent(self, word, segmented=False):
+        """Returns a float array with the information content of each segment 
+        of the word, retrieved from the precomputed vocabulary tables if possible"""
         #Return the pre-calculated information content of the word, if possible
         if segmented == True:
-            joined = ''.join([ch for ch in word])
-            if joined in self.info_contents:
-                return self.info_contents[joined]
+            joined = ''.join(word)
         else:
-            if word in self.info_contents:
-                return self.info_contents[word]
+            joined = word
+        if joined in self.info_contents:
+            return self.info_contents[joined]
         
-        #Otherwise calculate it from scratch
-        #First segment the word if necessary
-        #Then pad the segmented word
+        #Otherwise calculate it from scratch, first segmenting the word if necessary
         if segmented == False:
-            segments = segment_word(word)
-            padded = ['#', '#'] + segments + ['#', '#']
+            word = segment_word(word)
+        return self.infocontent_array([word])
+    
+    
+    def calculate_infocontent(self, word, segmented=False):
+        """Returns a dictionary of the information content of each segment of 
+        the word, indexed by position: {i:(segment, information content)}"""
+        #Segment the word once, then retrieve its precomputed information content 
+        #or calculate it from the segments
+        segments = word if segmented == True else segment_word(word)
+        joined = ''.join(word)
+        if joined in self.info_contents:
+            info_content = self.info_contents[joined]
         else:
-            padded = ['#', '#'] + word + ['#', '#']
-        info_content = {}
-        for i in range(2, len(padded)-2):
-            trigram_counts = 0
-            trigram_counts += self.trigrams[(padded[i-2], padded[i-1], padded[i])]
-            trigram_counts += self.trigrams[(padded[i-1], padded[i], padded[i+1])]
-            trigram_counts += self.trigrams[(padded[i], padded[i+1], padded[i+2])]
-            gappy_counts = 0
-            gappy_counts += self.gappy_trigrams[(padded[i-2], padded[i-1], 'X')]
-            gappy_counts += self.gappy_trigrams[(padded[i-1], 'X', padded[i+1])]
-            gappy_counts += self.gappy_trigrams[('X', padded[i+1], padded[i+2])]
-            info_content[i-2] = (padded[i], -math.log(trigram_counts/gappy_counts, 2))
-        self.info_contents[''.join(padded[2:-2])] = info_content
-        return info_content
+            info_content = self.infocontent_array([segments])
+        return {i:(segments[i], info_content[i]) for i in range(len(info_content))}
     
     def self_surprisal(self, word, segmented=False, normalize=False):
-        info_content = self.calculate_infocontent(word, segmented=segmented)
+        info_content = self.infocontent(word, segmented=segmented)
         if normalize == True:
-            return mean(info_content[j][1] for j in info_content)
+            return float(np.mean(info_content))
         else:
-            return sum(info_content[j][1] for j in info_content)
+            return float(np.sum(info_content))
     
-    def bigram_probability(self, bigram, delta=0.7):
-        """Returns Kneser-Ney smoothed conditional probability P(p2|p1)"""
-        
-        p1, p2 = bigram
+    def create_bigram_tables(self):
+        """Precomputes arrays of bigram counts and the Kneser-Ney continuation 
+        probabilities, history totals and history type counts of each segment,
+        indexed by segment ID (the final index is reserved for unknown segments)"""
+        n_ids = len(self.segment_ids) + 1
+        self.bigram_counts = np.zeros((n_ids, n_ids), dtype=np.int64)
+        for bigram in self.bigrams:
+            if self.bigrams[bigram] > 0:
+                p1, p2 = self.encode_segments(bigram)
+                self.bigram_counts[p1, p2] = self.bigrams[bigram]
         
         #Total number of distinct bigrams
-        n_bigrams = len(self.bigrams)
+        attested = self.bigram_counts > 0
+        n_bigrams = int(attested.sum())
         
-        #List of bigrams starting with p1
-        start_p1 = [b for b in self.bigrams if b[0] == p1]
+        #Unigram continuation probability: number of distinct bigrams ending in each segment
+        self.kn_continuation_probs = attested.sum(axis=0) / n_bigrams
         
-        #Number of bigrams starting with p1
-        n_start_p1 = len(start_p1)
+        #Total counts and number of distinct bigrams starting with each segment,
+        #for the normalizing constant lambda
+        self.kn_history_totals = self.bigram_counts.sum(axis=1)
+        self.kn_history_types = attested.sum(axis=1)
+    
+    
+    def bigram_probability(self, bigram, delta=0.7):
+        """Returns Kneser-Ney smoothed conditional probability P(p2|p1)"""
         
-        #Number of bigrams ending in p2
-        n_end_p2 = len([b for b in self.bigrams if b[1] == p2])
+        p1, p2 = [int(seg_id) for seg_id in self.encode_segments(bigram)]
+        
+        #Number of bigrams starting with p1
+        n_start_p1 = int(self.kn_history_types[p1])
         
         #Unigram probability estimation
-        pKN_p1 = n_end_p2 / n_bigrams
+        pKN_p1 = float(self.kn_continuation_probs[p2])
         
         #Normalizing constant lambda
-        total_start_p1_counts = sum([self.bigrams[b] for b in start_p1])
+        total_start_p1_counts = int(self.kn_history_totals[p1])
         l_KN = (delta / total_start_p1_counts) * n_start_p1
         
         #Bigram probability estimation
-        numerator = max((self.bigrams.get(bigram, 0)-delta), 0)
+        numerator = max((int(self.bigram_counts[p1, p2])-delta), 0)
         
         return (numerator/total_start_p1_counts) + (l_KN*pKN_p1)
+    
+    
+    def bigram_probabilities(self, segments, delta=0.7, pad=True):
+        """Returns an array of the Kneser-Ney smoothed conditional probabilities 
+        P(p2|p1) of each bigram in a sequence of segments; 
+        if pad == True, the sequence is first padded with word boundaries"""
+        if pad == True:
+            segments = ['#'] + list(segments) + ['#']
+        seg_ids = self.encode_segments(segments)
+        p1, p2 = seg_ids[:-1], seg_ids[1:]
+        
+        total_start_p1_counts = self.kn_history_totals[p1]
+        if (total_start_p1_counts == 0).any():
+            raise ZeroDivisionError('Kneser-Ney probability undefined for unattested bigram histories')
+        
+        l_KN = (delta / total_start_p1_counts) * self.kn_history_types[p1]
+        numerator = np.maximum(self.bigram_counts[p1, p2]-delta, 0)
+        
+        return (numerator/total_start_p1_counts) + (l_KN*self.kn_continuation_probs[p2])
         
         
     
@@ -1317,6 +1703,7 @@ class Language(LexicalDataset):
                          similarity='weighted_dice', 
                          method='ward', 
                          exclude_length=True, exclude_tones=True,
+                         exclude_features=[],
                          title=None, save_directory=None,
                          **kwargs):
         if title == None:
@@ -1333,11 +1720,15 @@ class Language(LexicalDataset):
         if exclude_tones == True:
             phonemes = [p for p in phonemes if p not in self.tonemes]
         
+        #Look up the pairwise phone similarities from the cached similarity matrix
+        sim_matrix = phone_sim_matrix(phonemes, similarity=similarity, 
+                                      exclude_features=exclude_features)
+        
         return draw_dendrogram(group=phonemes,
                                labels=phonemes, 
                                dist_func=phone_sim, 
                                sim=True, 
-                               similarity=similarity, 
+                               batch_func=lambda rows, cols, **kwargs: sim_matrix[rows, cols],
                                method=method, 
                                title=title, 
                                save_directory=save_directory, 
@@ -2,6 +2,143 @@ import os, itertools, random
 from auxiliary_functions import *
 from phonetic_distance import *
 from statistics import mean, stdev
+from collections.abc import KeysView, ValuesView, ItemsView
+
+
+class SurprisalTable(dict):
+    """Nested dictionary of interpolated Lidstone-smoothed surprisal values of 
+    language 2 segments given language 1 ngrams. Only the observed counts and 
+    per-history totals are stored: the surprisal values of an ngram are calculated 
+    when it is first looked up, from smoothed estimates memoized per history"""
+    
+    def __init__(self, interpolation, segments1, segments2, ngram_size, weights, 
+                 default, d, attested=None, alpha=0.1):
+        super().__init__()
+        self.interpolation = interpolation
+        self.totals = {i:{history:sum(interpolation[i][history].values()) 
+                          for history in interpolation[i]} 
+                       for i in interpolation}
+        self.segments1 = list(dict.fromkeys(segments1))
+        self.segment_set1 = set(segments1)
+        self.segments2 = list(segments2)
+        self.ngram_size = ngram_size
+        self.weights = weights
+        self.default = default
+        self.attested = set(attested) if attested != None else None
+        self.d = d
+        self.alpha = alpha
+        self.estimates = {}
+        
+        #Number of listed ngrams, and the (insertion-ordered) ngrams outside of 
+        #these which have been stored since, so that the length is known without 
+        #enumerating all ngrams
+        self.n_listed = self.count_listed()
+        self.unlisted = {}
+    
+    def history_estimates(self, i, history):
+        """Returns the smoothed estimates of segments observed after the history, 
+        and the estimate of unobserved segments"""
+        key = (i, history)
+        if key not in self.estimates:
+            counts = self.interpolation.get(i, {}).get(history, {})
+            N = self.totals.get(i, {}).get(history, 0)
+            self.estimates[key] = ({seg2:lidstone_smoothing(x=counts[seg2], N=N, d=self.d, alpha=self.alpha) 
+                                    for seg2 in counts},
+                                   lidstone_smoothing(x=0, N=N, d=self.d, alpha=self.alpha))
+        return self.estimates[key]
+    
+    def smoothed_row(self, ngram1):
+        """Calculates the smoothed surprisal of each segment of language 2 given the ngram"""
+        estimates = [self.history_estimates(i, ngram1[:i]) for i in range(self.ngram_size,0,-1)]
+        row = {}
+        for seg2 in self.segments2:
+            smoothed = sum([estimate.get(seg2, oov)*weight 
+                            for (estimate, oov), weight in zip(estimates, self.weights)])
+            row[seg2] = surprisal(smoothed)
+        smoothed_oov = surprisal(sum([oov*weight for (estimate, oov), weight in zip(estimates, self.weights)]))
+        return default_dict(row, l=smoothed_oov)
+    
+    def in_product(self, ngram1):
+        """Checks whether the ngram is a sequence of ngram_size language 1 segments"""
+        return (len(ngram1) == self.ngram_size) and all(seg in self.segment_set1 for seg in ngram1)
+    
+    def listed(self, ngram1):
+        """Checks whether the ngram has been observed or could have been observed (with gaps)"""
+        if (self.attested != None) and (ngram1 in self.attested):
+            return True
+        if self.in_product(ngram1) == False:
+            return False
+        return (self.attested == None) or ('-' in ngram1)
+    
+    def count_listed(self):
+        """Returns the number of ngrams for which surprisal values are calculated"""
+        n_segments = len(self.segments1)
+        if self.attested == None:
+            return n_segments**self.ngram_size
+        
+        #Ngrams with gaps, plus the attested ngrams which are not among these
+        n_gapped = n_segments**self.ngram_size - (n_segments-1)**self.ngram_size if '-' in self.segment_set1 else 0
+        return n_gapped + len([ngram1 for ngram1 in self.attested 
+                               if not (('-' in ngram1) and self.in_product(ngram1))])
+    
+    def listed_ngrams(self):
+        """Yields each ngram for which surprisal values are calculated"""
+        if self.attested == None:
+            yield from itertools.product(self.segments1, repeat=self.ngram_size)
+            return
+        
+        yield from self.attested
+        
+        #Ngrams with gaps, generated by the position of their first gap
+        if '-' in self.segment_set1:
+            others = [seg for seg in self.segments1 if seg != '-']
+            for i in range(self.ngram_size):
+                for before in itertools.product(others, repeat=i):
+                    for after in itertools.product(self.segments1, repeat=self.ngram_size-i-1):
+                        ngram1 = before + ('-',) + after
+                        if ngram1 not in self.attested:
+                            yield ngram1
+    
+    def __missing__(self, ngram1):
+        if self.listed(ngram1) == True:
+            row = self.smoothed_row(ngram1)
+        else:
+            row = defaultdict(lambda:self.default)
+        self[ngram1] = row
+        return row
+    
+    def __setitem__(self, ngram1, row):
+        if self.listed(ngram1) == False:
+            self.unlisted[ngram1] = True
+        dict.__setitem__(self, ngram1, row)
+    
+    def __delitem__(self, ngram1):
+        self.unlisted.pop(ngram1, None)
+        dict.__delitem__(self, ngram1)
+    
+    def __contains__(self, ngram1):
+        return dict.__contains__(self, ngram1) or self.listed(ngram1)
+    
+    def __iter__(self):
+        yield from self.listed_ngrams()
+        yield from list(self.unlisted)
+    
+    def __len__(self):
+        return self.n_listed + len(self.unlisted)
+    
+    def get(self, ngram1, default=None):
+        if ngram1 in self:
+            return self[ngram1]
+        return default
+    
+    def keys(self):
+        return KeysView(self)
+    
+    def values(self):
+        return ValuesView(self)
+    
+    def items(self):
+        return ItemsView(self)
 
 
 class PhonemeCorrDetector:
@@ -10,6 +147,12 @@ class PhonemeCorrDetector:
         self.lang2 = lang2
         self.same_meaning, self.diff_meaning, self.loanwords = self.prepare_wordlists(wordlist)
         self.pmi_dict = self.lang1.phoneme_pmi[self.lang2]
+        
+        #Integer codes of each language's segments and their compatibility matrix, 
+        #created when first needed
+        self.segments1, self.segments2 = [], []
+        self.segment_codes1, self.segment_codes2 = {}, {}
+        self.compatibility = None
         #self.surprisal_dict = self.lang1.phoneme_surprisal[self.lang2]
     
     def prepare_wordlists(self, wordlist):
@@ -60,51 +203,154 @@ class PhonemeCorrDetector:
                 for pair in wordlist]
     
     
-    def correspondence_probs(self, alignment_list, ngram_size=1,
-                             counts=False, exclude_null=True):
-        """Returns a dictionary of conditional phone probabilities, based on a list
-        of alignments.
-        counts : Bool; if True, returns raw counts instead of normalized probabilities;
-        exclude_null : Bool; if True, does not consider aligned pairs including a null segment"""
-        corr_counts = defaultdict(lambda:defaultdict(lambda:0))
+    def count_correspondences(self, alignment_list, ngram_size=1, exclude_null=True):
+        """Counts the ngram correspondences in a list of alignments over integer-coded ngrams.
+        Returns arrays of the language 1 ngram codes, language 2 ngram codes and counts 
+        of each distinct correspondence, ordered by language 1 ngram and then by first 
+        occurrence, together with the lists of language 1 and language 2 ngrams indexed by the codes"""
+        ngram_ids1, ngram_ids2 = {}, {}
+        codes1, codes2 = [], []
+        pad_n = ngram_size - 1
         for alignment in alignment_list:
             if exclude_null == True:
                 alignment = [pair for pair in alignment if '-' not in pair]
             if ngram_size > 1:
-                pad_n = ngram_size - 1
                 alignment = [('#', '#')]*pad_n + alignment + [('#', '#')]*pad_n
-                
-            for i in range(ngram_size-1, len(alignment)):
-                ngram = alignment[i-(ngram_size-1):i+1]
-                segs = list(zip(*ngram))
-                seg1, seg2 = segs
-                corr_counts[seg1][seg2] += 1
+            
+            segs1 = [pair[0] for pair in alignment]
+            segs2 = [pair[1] for pair in alignment]
+            for ngram in zip(*[segs1[i:] for i in range(ngram_size)]):
+                codes1.append(ngram_ids1.setdefault(ngram, len(ngram_ids1)))
+            for ngram in zip(*[segs2[i:] for i in range(ngram_size)]):
+                codes2.append(ngram_ids2.setdefault(ngram, len(ngram_ids2)))
+        
+        #Count each distinct correspondence from a single integer key per correspondence
+        n_ngrams2 = max(len(ngram_ids2), 1)
+        keys = np.array(codes1, dtype=np.int64)*n_ngrams2 + np.array(codes2, dtype=np.int64)
+        distinct, first_index, counts = np.unique(keys, return_index=True, return_counts=True)
+        rows, cols = distinct // n_ngrams2, distinct % n_ngrams2
+        
+        #Language 1 ngrams are coded in order of first occurrence
+        order = np.lexsort((first_index, rows))
+        return rows[order], cols[order], counts[order], list(ngram_ids1), list(ngram_ids2)
+    
+    
+    def correspondence_probs(self, alignment_list, ngram_size=1,
+                             counts=False, exclude_null=True, unwrap=False):
+        """Returns a dictionary of conditional phone probabilities, based on a list
+        of alignments.
+        counts : Bool; if True, returns raw counts instead of normalized probabilities;
+        exclude_null : Bool; if True, does not consider aligned pairs including a null segment;
+        unwrap : Bool; if True, keys unigram correspondences by segments rather than 1-tuples"""
+        rows, cols, corr_counts, ngrams1, ngrams2 = self.count_correspondences(alignment_list, 
+                                                                               ngram_size=ngram_size, 
+                                                                               exclude_null=exclude_null)
         if counts == False:
-            for seg1 in corr_counts:
-                corr_counts[seg1] = normalize_dict(corr_counts[seg1])
-        return corr_counts
+            corr_counts = corr_counts / np.bincount(rows, weights=corr_counts)[rows]
+        if unwrap == True:
+            ngrams1 = [ngram[0] for ngram in ngrams1]
+            ngrams2 = [ngram[0] for ngram in ngrams2]
+        
+        corr_dict = defaultdict(lambda:defaultdict(lambda:0))
+        for seg1, seg2, value in zip(rows.tolist(), cols.tolist(), corr_counts.tolist()):
+            corr_dict[ngrams1[seg1]][ngrams2[seg2]] = value
+        return corr_dict
+    
     
+    def encode_words(self, words, lang_index):
+        """Returns an array of the integer codes of the segments of the words 
+        (concatenated) in language 1 or 2 (lang_index), and an array of the word lengths;
+        codes any new segments and updates the compatibility matrix accordingly"""
+        if lang_index == 1:
+            segments, segment_codes = self.segments1, self.segment_codes1
+        else:
+            segments, segment_codes = self.segments2, self.segment_codes2
+        
+        codes = []
+        for word in words:
+            for seg in word:
+                if seg not in segment_codes:
+                    segment_codes[seg] = len(segments)
+                    segments.append(seg)
+                    self.compatibility = None
+                codes.append(segment_codes[seg])
+        
+        if self.compatibility is None:
+            self.compatibility = compatibility_matrix(self.segments1, self.segments2)
+        return np.array(codes, dtype=int), np.array([len(word) for word in words], dtype=int)
     
-    def radial_counts(self, wordlist, radius=2, normalize=True):
+    
+    def radial_count_matrix(self, wordlist, radius=2):
+        """Returns a matrix of the number of times that each phone of language 1 
+        occurs within a specified radius of positions of each phone of language 2
+        in their respective words, indexed by segment codes, and an array of the 
+        (flattened) indices of the counted phone pairs in order of first occurrence"""
+        
+        #Code each language's segments as integers, starting with the full inventories
+        if len(self.segments1) == 0:
+            self.encode_words([list(self.lang1.phonemes.keys())], 1)
+            self.encode_words([list(self.lang2.phonemes.keys())], 2)
+        codes1, lengths1 = self.encode_words([item[0][3] for item in wordlist], 1)
+        codes2, lengths2 = self.encode_words([item[1][3] for item in wordlist], 2)
+        n_pairs = len(self.segments1) * len(self.segments2)
+        if len(codes1) == 0:
+            return np.zeros((len(self.segments1), len(self.segments2)), dtype=int), np.array([], dtype=int)
+        
+        #Word index and within-word position of each segment of the first words,
+        #and the start of the corresponding second word
+        word_index = np.repeat(np.arange(len(wordlist)), lengths1)
+        positions = np.arange(len(codes1)) - np.repeat(np.cumsum(lengths1) - lengths1, lengths1)
+        starts2 = (np.cumsum(lengths2) - lengths2)[word_index]
+        
+        #Pair each position i of the first word with positions i-radius to i+radius
+        #of the second word, in the order (word pair, i, j)
+        j = positions[:, None] + np.arange(-radius, radius+1)
+        in_word = (j >= 0) & (j < lengths2[word_index][:, None])
+        codes1 = np.broadcast_to(codes1[:, None], j.shape)[in_word]
+        codes2 = codes2[(starts2[:, None] + j)[in_word]]
+        
+        #Only count sounds which are compatible as corresponding
+        compatible = self.compatibility[codes1, codes2]
+        codes1, codes2 = codes1[compatible], codes2[compatible]
+        
+        #Count each pair of segments
+        pair_codes = (codes1 * len(self.segments2)) + codes2
+        counts = np.bincount(pair_codes, minlength=n_pairs).reshape(len(self.segments1), len(self.segments2))
+        
+        #Order the counted pairs by their first occurrence
+        pairs, first_index = np.unique(pair_codes, return_index=True)
+        ordered_pairs = pairs[np.argsort(first_index, kind='stable')]
+        
+        return counts, ordered_pairs
+    
+    
+    def radial_counts(self, wordlist, radius=2, normalize=True, reverse=False):
         """Checks the number of times that phones occur within a specified 
-        radius of positions in their respective words from one another"""
+        radius of positions in their respective words from one another;
+        if reverse == True, also returns the counts from language 2 to language 1"""
         corr_dict = defaultdict(lambda:defaultdict(lambda:0))
+        reverse_dict = defaultdict(lambda:defaultdict(lambda:0))
+        counts, ordered_pairs = self.radial_count_matrix(wordlist, radius)
         
-        for item in wordlist:
-            segs1, segs2 = item[0][3], item[1][3]
-            for i in range(len(segs1)):
-                seg1 = segs1[i]
-                for j in range(max(0, i-radius), min(i+radius+1, len(segs2))):
-                    seg2 = segs2[j]
-                    
-                    #Only count sounds which are compatible as corresponding
-                    if compatible_segments(seg1, seg2) == True:
-                        corr_dict[seg1][seg2] += 1
+        #Add the pairs to the dictionaries in the order in which they were first found,
+        #grouped by the language 1 segment (the order produced by reverse_corr_dict)
+        codes1, codes2 = np.divmod(ordered_pairs, len(self.segments2))
+        seg1_order = np.zeros(len(self.segments1), dtype=int)
+        first_codes1, first_index = np.unique(codes1, return_index=True)
+        seg1_order[first_codes1] = first_index
+        for k in np.lexsort((np.arange(len(ordered_pairs)), seg1_order[codes1])):
+            seg1, seg2 = self.segments1[codes1[k]], self.segments2[codes2[k]]
+            corr_dict[seg1][seg2] = int(counts[codes1[k], codes2[k]])
+            if reverse == True:
+                reverse_dict[seg2][seg1] = corr_dict[seg1][seg2]
                         
         if normalize == True:
-            for seg1 in corr_dict:
-                corr_dict[seg1] = normalize_dict(corr_dict[seg1])
+            for d in [corr_dict, reverse_dict]:
+                for seg in d:
+                    d[seg] = normalize_dict(d[seg])
         
+        if reverse == True:
+            return corr_dict, reverse_dict
         return corr_dict
     
     def reverse_corr_dict(self, corr_dict):
@@ -126,44 +372,82 @@ class PhonemeCorrDetector:
         if l2 == None:
             l2 = self.lang2
 
+        #Index the segments of each language, starting with the phoneme inventories
+        corr_dicts = [dependent_probs] + ([independent_probs] if independent_probs != None else [])
+        segments1 = list(dict.fromkeys(list(l1.phonemes.keys()) + [seg1 for corr_dict in corr_dicts for seg1 in corr_dict]))
+        segments2 = list(dict.fromkeys(list(l2.phonemes.keys()) + [seg2 for corr_dict in corr_dicts 
+                                                                   for seg1 in corr_dict for seg2 in corr_dict[seg1]]))
+        ids1 = {seg1:i for i, seg1 in enumerate(segments1)}
+        ids2 = {seg2:j for j, seg2 in enumerate(segments2)}
+        freqs1 = np.array([l1.phonemes.get(seg1, 0) for seg1 in segments1], dtype=float)
+        freqs2 = np.array([l2.phonemes.get(seg2, 0) for seg2 in segments2], dtype=float)
+        
+        #Probability of each pair of segments co-occurring independently
+        p_ind = np.outer(freqs1, freqs2)
+        
+        def joint_probs(corr_dict):
+            """Returns a matrix of joint probabilities from the nested dictionary of 
+            conditional probabilities, and a mask of the pairs it contains"""
+            probs = np.zeros(p_ind.shape)
+            present = np.zeros(p_ind.shape, dtype=bool)
+            totals = np.zeros(len(segments1))
+            for seg1 in corr_dict:
+                i = ids1[seg1]
+                totals[i] = sum(corr_dict[seg1].values())
+                for seg2 in corr_dict[seg1]:
+                    probs[i, ids2[seg2]] = corr_dict[seg1][seg2]
+                    present[i, ids2[seg2]] = True
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return probs / totals[:, None] * freqs1[:, None], present
+        
+        #Calculate joint probabilities from conditional probabilities
+        dependent_joint, dependent_present = joint_probs(dependent_probs)
+        
         #If no independent probabilities are specified, 
         #use product of phoneme probabilities by default
         if independent_probs == None:
-            independent_probs = defaultdict(lambda:defaultdict(lambda:0))
-            for phoneme1 in l1.phonemes:
-                for phoneme2 in l2.phonemes:
-                    independent_probs[phoneme1][phoneme2] = l1.phonemes[phoneme1] * l2.phonemes[phoneme2]
-
-        #Calculate joint probabilities from conditional probabilities
-        for corr_dict in [dependent_probs, independent_probs]:
-            for seg1 in corr_dict:
-                seg1_totals = sum(corr_dict[seg1].values())
-                for seg2 in corr_dict[seg1]:
-                    cond_prob = corr_dict[seg1][seg2] / seg1_totals
-                    joint_prob = cond_prob * l1.phonemes[seg1]
-                    corr_dict[seg1][seg2] = joint_prob
-                    
-        #Get set of all possible phoneme correspondences
-        segment_pairs = set([(seg1, seg2)
-                         for corr_dict in [dependent_probs, independent_probs]
-                         for seg1 in corr_dict 
-                         for seg2 in corr_dict[seg1]])
-            
-        #Calculate PMI for all phoneme pairs
+            n1, n2 = len(l1.phonemes), len(l2.phonemes)
+            independent_joint = np.zeros(p_ind.shape)
+            independent_present = np.zeros(p_ind.shape, dtype=bool)
+            totals = np.cumsum(p_ind[:n1, :n2], axis=1)[:, -1] if n2 > 0 else np.zeros(n1)
+            independent_present[:n1, :n2] = (totals > 0)[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                independent_joint[:n1, :n2] = p_ind[:n1, :n2] / totals[:, None] * freqs1[:n1, None]
+        else:
+            independent_joint, independent_present = joint_probs(independent_probs)
+        
+        #Calculate PMI for all phoneme pairs in either set of probabilities, 
+        #falling back to the independent probability for pairs missing from one of them
+        cognate_probs = np.where(dependent_present, dependent_joint, p_ind)
+        noncognate_probs = np.where(independent_present, independent_joint, p_ind)
+        rows, cols = np.nonzero(dependent_present | independent_present)
+        pmi_values = np.log(cognate_probs[rows, cols] / noncognate_probs[rows, cols])
+        
         pmi_dict = defaultdict(lambda:defaultdict(lambda:0))
-        for segment_pair in segment_pairs:
-            seg1, seg2 = segment_pair
-            p_ind = l1.phonemes[seg1] * l2.phonemes[seg2]
-            cognate_prob = dependent_probs[seg1].get(seg2, p_ind)
-            noncognate_prob = independent_probs[seg1].get(seg2, p_ind)
-            pmi_dict[seg1][seg2] = math.log(cognate_prob/noncognate_prob)
+        for i, j, pmi in zip(rows.tolist(), cols.tolist(), pmi_values.tolist()):
+            pmi_dict[segments1[i]][segments2[j]] = pmi
         
         return pmi_dict
 
 
+    def pmi_changes(self, pmi_dict1, pmi_dict2, tolerance=0):
+        """Returns a dictionary of the segments of language 2 whose PMI with each 
+        segment of language 1 differs by more than the tolerance between the two PMI dictionaries"""
+        changes = defaultdict(lambda:set())
+        for seg1 in set(pmi_dict1.keys()) | set(pmi_dict2.keys()):
+            pmi1, pmi2 = pmi_dict1.get(seg1, {}), pmi_dict2.get(seg1, {})
+            for seg2 in set(pmi1.keys()) | set(pmi2.keys()):
+                if abs(pmi1.get(seg2, 0) - pmi2.get(seg2, 0)) > tolerance:
+                    changes[seg1].add(seg2)
+        return changes
+    
+    
     def calc_phoneme_pmi(self, radius=2, max_iterations=10,
                           p_threshold=0.1,
                           seed=1, 
+                          incremental=True, pmi_tolerance=0, 
+                          pmi_convergence=None,
+                          initial_pmi=None,
                           print_iterations=False, save=True):
         """
         Parameters
@@ -176,6 +460,18 @@ class PhonemeCorrDetector:
             p-value threshold for words to qualify for PMI calculation in the next iteration. The default is 0.05.
         seed : int, optional
             Random seed for drawing a sample of different meaning word pairs. The default is 1.
+        incremental : bool, optional
+            Whether to reuse the alignments of word pairs none of whose segment pairs' PMI values 
+            changed by more than pmi_tolerance since they were aligned, rather than realigning them. The default is True.
+        pmi_tolerance : float, optional
+            Largest change in a PMI value which does not require realignment. The default is 0.
+        pmi_convergence : float or None, optional
+            If specified, iteration also stops once no PMI value changes by more than this amount 
+            from one iteration to the next. The default is None.
+        initial_pmi : dict or None, optional
+            Nested dictionary of previously calculated PMI values (e.g. loaded from file) 
+            to use as the starting point in place of the radial co-occurrence PMI; the initial
+            qualifying word pairs are then those which qualify when aligned with these values. The default is None.
         print_iterations : bool, optional
             Whether to print the results of each iteration. The default is False.
         save : bool, optional
@@ -191,26 +487,27 @@ class PhonemeCorrDetector:
         sample_size = len(self.same_meaning)
         diff_sample = random.sample(self.diff_meaning, min(sample_size, len(self.diff_meaning)))
 
-        #First step: calculate probability of phones co-occuring within within 
-        #a set radius of positions within their respective words
-        #synonyms_radius = self.radial_counts(self.same_meaning, radius)
-        
-        
-        #new
-        synonyms_radius1 = self.radial_counts(self.same_meaning, radius, normalize=False)
-        synonyms_radius2 = self.reverse_corr_dict(synonyms_radius1)
-        for d in [synonyms_radius1, synonyms_radius2]:
-            for seg1 in d:
-                d[seg1] = normalize_dict(d[seg1])
-        pmi_step1 = [self.phoneme_pmi(dependent_probs=synonyms_radius1, l1=self.lang1, l2=self.lang2),
-                     self.phoneme_pmi(dependent_probs=synonyms_radius2, l1=self.lang2, l2=self.lang1)]
-        pmi_dict_l1l2, pmi_dict_l2l1 = pmi_step1
+        #Warm start from previously calculated PMI values if provided
+        if initial_pmi != None:
+            pmi_step1 = defaultdict(lambda:defaultdict(lambda:0))
+            for seg1 in initial_pmi:
+                for seg2 in initial_pmi[seg1]:
+                    pmi_step1[seg1][seg2] = initial_pmi[seg1][seg2]
         
-        #Average together the PMI values from each direction
-        pmi_step1 = defaultdict(lambda:defaultdict(lambda:0))
-        for seg1 in pmi_dict_l1l2:
-            for seg2 in pmi_dict_l1l2[seg1]:
-                pmi_step1[seg1][seg2] = mean([pmi_dict_l1l2[seg1][seg2], pmi_dict_l2l1[seg2][seg1]])
+        else:
+            #Otherwise, first step: calculate probability of phones co-occuring within within 
+            #a set radius of positions within their respective words
+            #synonyms_radius = self.radial_counts(self.same_meaning, radius)
+            synonyms_radius1, synonyms_radius2 = self.radial_counts(self.same_meaning, radius, reverse=True)
+            pmi_step1 = [self.phoneme_pmi(dependent_probs=synonyms_radius1, l1=self.lang1, l2=self.lang2),
+                         self.phoneme_pmi(dependent_probs=synonyms_radius2, l1=self.lang2, l2=self.lang1)]
+            pmi_dict_l1l2, pmi_dict_l2l1 = pmi_step1
+            
+            #Average together the PMI values from each direction
+            pmi_step1 = defaultdict(lambda:defaultdict(lambda:0))
+            for seg1 in pmi_dict_l1l2:
+                for seg2 in pmi_dict_l1l2[seg1]:
+                    pmi_step1[seg1][seg2] = mean([pmi_dict_l1l2[seg1][seg2], pmi_dict_l2l1[seg2][seg1]])
         
         
         #At each following iteration N, re-align using the pmi_stepN as an 
@@ -219,53 +516,98 @@ class PhonemeCorrDetector:
         PMI_iterations = {iteration:pmi_step1}
         qualifying_words = default_dict({iteration:sorted(self.same_meaning)}, l=[])
         disqualified_words = default_dict({iteration:diff_sample}, l=[])
-        while (iteration < max_iterations) and (qualifying_words[iteration] != qualifying_words[iteration-1]):
+        
+        #Alignments of word pairs, with the iteration of the PMI values used to align them,
+        #and the PMI changes since each earlier iteration
+        alignment_cache = {}
+        changes_since = {}
+        def align_pairs(wordlist):
+            """Aligns the word pairs using the previous iteration's PMI,
+            reusing earlier alignments if incremental == True"""
+            if incremental == False:
+                return self.align_wordlist(wordlist, added_penalty_dict=PMI_iterations[iteration-1])
+            
+            alignments = []
+            for pair in wordlist:
+                segs1, segs2 = pair[0][-1], pair[1][-1]
+                key = (tuple(segs1), tuple(segs2))
+                if key in alignment_cache:
+                    alignment, aligned_iteration = alignment_cache[key]
+                    if aligned_iteration not in changes_since:
+                        changes_since[aligned_iteration] = self.pmi_changes(PMI_iterations[aligned_iteration], 
+                                                                            PMI_iterations[iteration-1],
+                                                                            tolerance=pmi_tolerance)
+                    changes = changes_since[aligned_iteration]
+                    set2 = set(segs2)
+                    if not any(changes[seg1] & set2 for seg1 in set(segs1) if seg1 in changes):
+                        alignments.append(alignment)
+                        continue
+                    
+                alignment = phone_align(segs1, segs2, added_penalty_dict=PMI_iterations[iteration-1])
+                alignment_cache[key] = (alignment, iteration-1)
+                alignments.append(alignment)
+            return alignments
+        
+        def split_pairs(pmi, same_meaning_alignments, noncognate_alignments):
+            """Splits the same-meaning word pairs into those whose alignments' mean PMI
+            is significant against that of the noncognate alignments and the rest"""
+            noncognate_PMI = [mean([pmi[pair[0]][pair[1]] for pair in alignment]) 
+                              for alignment in noncognate_alignments]
+            PMI_scores = [mean([pmi[pair[0]][pair[1]] for pair in same_meaning_alignments[i]])
+                          for i in range(len(self.same_meaning))]
+            
+            #pnorm = norm.cdf(PMI_score, loc=nc_mean, scale=nc_stdev)
+            #p_value = 1 - pnorm
+            p_values = empirical_p_values(PMI_scores, noncognate_PMI, greater=True)
+            qualifying, disqualified = [], []
+            for i in range(len(self.same_meaning)):
+                if p_values[i] < p_threshold:
+                    qualifying.append(self.same_meaning[i])
+                else:
+                    disqualified.append(self.same_meaning[i])
+            return qualifying, disqualified
+        
+        #With a warm start, the initial qualifying word pairs are those which 
+        #qualify when aligned and scored with the initial PMI values
+        if initial_pmi != None:
+            same_meaning_alignments = self.align_wordlist(self.same_meaning, added_penalty_dict=pmi_step1)
+            diff_sample_alignments = self.align_wordlist(diff_sample, added_penalty_dict=pmi_step1)
+            if incremental == True:
+                for pair, alignment in zip(self.same_meaning + diff_sample, 
+                                           same_meaning_alignments + diff_sample_alignments):
+                    alignment_cache[(tuple(pair[0][-1]), tuple(pair[1][-1]))] = (alignment, 0)
+            qualifying, disqualified = split_pairs(pmi_step1, same_meaning_alignments, diff_sample_alignments)
+            qualifying_words[0] = sorted(qualifying)
+            disqualified_words[0] = disqualified + diff_sample
+        
+        converged = False
+        while (iteration < max_iterations) and (qualifying_words[iteration] != qualifying_words[iteration-1]) and (converged == False):
             iteration += 1
+            changes_since.clear()
             
             #Align the qualifying words of the previous step using previous step's PMI
-            cognate_alignments = self.align_wordlist(qualifying_words[iteration-1], 
-                                                     added_penalty_dict=PMI_iterations[iteration-1])
+            cognate_alignments = align_pairs(qualifying_words[iteration-1])
             
             #Align the sample of different meaning and non-qualifying words again using previous step's PMI
-            noncognate_alignments = self.align_wordlist(disqualified_words[iteration-1],
-                                                        added_penalty_dict=PMI_iterations[iteration-1])
+            noncognate_alignments = align_pairs(disqualified_words[iteration-1])
             
             #Calculate correspondence probabilities and PMI values from these alignments
-            cognate_probs = self.correspondence_probs(cognate_alignments)
-            cognate_probs = default_dict({k[0]:{v[0]:cognate_probs[k][v] 
-                                                for v in cognate_probs[k]} 
-                                          for k in cognate_probs}, l=defaultdict(lambda:0))
+            cognate_probs = self.correspondence_probs(cognate_alignments, unwrap=True)
             #noncognate_probs = self.correspondence_probs(noncognate_alignments)
             PMI_iterations[iteration] = self.phoneme_pmi(cognate_probs)#, noncognate_probs)
             
+            #Check whether the PMI values have converged
+            if pmi_convergence != None:
+                if len(self.pmi_changes(PMI_iterations[iteration-1], PMI_iterations[iteration], 
+                                        tolerance=pmi_convergence)) == 0:
+                    converged = True
+            
             #Align all same-meaning word pairs
-            all_alignments = self.align_wordlist(self.same_meaning, 
-                                                 added_penalty_dict=PMI_iterations[iteration-1])
+            all_alignments = align_pairs(self.same_meaning)
 
-            #Score PMI for different meaning words and words disqualified in previous iteration
-            noncognate_PMI = []
-            for alignment in noncognate_alignments:
-                noncognate_PMI.append(mean([PMI_iterations[iteration][pair[0]][pair[1]] 
-                                            for pair in alignment]))
-            #nc_mean = mean(noncognate_PMI)
-            #nc_stdev = stdev(noncognate_PMI)
-            
             #Score same-meaning alignments for overall PMI and calculate p-value
-            #against different-meaning alignments
-            qualifying, disqualified = [], []
-            for i in range(len(self.same_meaning)):
-                alignment = all_alignments[i]
-                item = self.same_meaning[i]
-                PMI_score = mean([PMI_iterations[iteration][pair[0]][pair[1]] 
-                                for pair in alignment])
-                
-                #pnorm = norm.cdf(PMI_score, loc=nc_mean, scale=nc_stdev)
-                #p_value = 1 - pnorm
-                p_value = (len([score for score in noncognate_PMI if score >= PMI_score])+1) / (len(noncognate_PMI)+1)
-                if p_value < p_threshold:
-                    qualifying.append(item)
-                else:
-                    disqualified.append(item)
+            #against different-meaning words and words disqualified in previous iteration
+            qualifying, disqualified = split_pairs(PMI_iterations[iteration], all_alignments, noncognate_alignments)
             qualifying_words[iteration] = sorted(qualifying)
             disqualified_words[iteration] = disqualified + diff_sample
             
@@ -293,8 +635,11 @@ class PhonemeCorrDetector:
         if save == True:
             self.lang1.phoneme_pmi[self.lang2] = results
             self.lang2.phoneme_pmi[self.lang1] = self.reverse_corr_dict(results)
+            self.lang1.phoneme_pmi_versions[self.lang2] += 1
+            self.lang2.phoneme_pmi_versions[self.lang1] += 1
             #self.lang1.phoneme_pmi[self.lang2]['thresholds'] = noncognate_PMI
         self.pmi_dict = results
+        self.pmi_iterations = iteration
         
         return results
 
@@ -317,7 +662,12 @@ class PhonemeCorrDetector:
         
     
     def phoneme_surprisal(self, correspondence_counts, ngram_size=1, weights=None,
-                          attested_only=True):
+                          attested_only=True, l1=None, l2=None):
+        if l1 == None:
+            l1 = self.lang1
+        if l2 == None:
+            l2 = self.lang2
+        
         #Interpolation smoothing
         if weights == None:
             weights = [1/ngram_size for i in range(ngram_size)]
@@ -336,60 +686,27 @@ class PhonemeCorrDetector:
                         interpolation[i][ngram1[:i]][ngram2[0]] += correspondence_counts[ngram1][ngram2]
             
         
-        smoothed_surprisal = defaultdict(lambda:defaultdict(lambda:self.lang2.phoneme_entropy*ngram_size))
-        
-        #Iterate over all possible ngrams
-        all_ngrams = list(itertools.product(list(self.lang1.phonemes.keys())+['#', '-'], repeat=ngram_size))
-        
-        #Only perform calculation for ngrams which have actually been observed 
-        #in the current dataset or which could have been observed (with gaps)
+        #Only calculate values for ngrams which have actually been observed 
+        #in the current dataset or which could have been observed (with gaps),
+        #unless attested_only == False
+        attested = None
         if attested_only == True:
-            attested = [tuple(ngram.split()) if type(ngram) == str else ngram for ngram in self.lang1.list_ngrams(ngram_size)]
-            gappy = [ngram for ngram in all_ngrams if '-' in ngram]
-            all_ngrams = set(attested + gappy)
-            
-        for ngram1 in all_ngrams:
-            for ngram2 in list(self.lang2.phonemes.keys())+['#', '-']: 
-                #forward
-                # estimates = [interpolation[i][ngram1[-i:]][ngram2] / sum(interpolation[i][ngram1[-i:]].values())
-                #              if i > 1 else lidstone_smoothing(x=interpolation[i][ngram1[-i:]][ngram2], 
-                #                                               N=sum(interpolation[i][ngram1[-i:]].values()), 
-                #                                               d = len(self.lang2.phonemes) + 1)  
-                #              for i in range(ngram_size,0,-1)]
-                
-                #backward
-                estimates = [lidstone_smoothing(x=interpolation[i][ngram1[:i]].get(ngram2, 0), 
-                                                 N=sum(interpolation[i][ngram1[:i]].values()), 
-                                                 d = len(self.lang2.phonemes) + 1,
-                                                 alpha=0.1) 
-                              for i in range(ngram_size,0,-1)] 
-                
-                
-                
-                smoothed = sum([estimate*weight for estimate, weight in zip(estimates, weights)])
-                smoothed_surprisal[ngram1][ngram2] = surprisal(smoothed)
-                
-            oov_estimates = [lidstone_smoothing(x=0, N=sum(interpolation[i][ngram1[:i]].values()), 
-                                             d = len(self.lang2.phonemes) + 1,
-                                             alpha=0.1) 
-                          for i in range(ngram_size,0,-1)]
-            smoothed_oov = surprisal(sum([estimate*weight for estimate, weight in zip(oov_estimates, weights)]))
-            smoothed_surprisal[ngram1] = default_dict(smoothed_surprisal[ngram1], l=smoothed_oov)
+            attested = [tuple(ngram.split()) if type(ngram) == str else ngram for ngram in l1.list_ngrams(ngram_size)]
+        
+        #Smoothed surprisal values are calculated as each ngram is looked up
+        smoothed_surprisal = SurprisalTable(interpolation, 
+                                            segments1=list(l1.phonemes.keys())+['#', '-'],
+                                            segments2=list(l2.phonemes.keys())+['#', '-'],
+                                            ngram_size=ngram_size, weights=weights,
+                                            default=l2.phoneme_entropy*ngram_size,
+                                            d=len(l2.phonemes) + 1,
+                                            attested=attested)
                 
         return smoothed_surprisal
     
-    def calc_phoneme_surprisal(self, radius=2, 
-                               max_iterations=10, 
-                               p_threshold=0.1,
-                               ngram_size=2,
-                               print_iterations=False,
-                               seed=1,
-                               save=True):
-        #METHOD
-        #1) Calculate phoneme PMI
-        #2) Use phoneme PMI to align 
-        #3) Iterate
-        
+    def surprisal_alignments(self, radius=2, max_iterations=10, p_threshold=0.1, seed=1):
+        """Returns the PMI alignments of the same-meaning word pairs and of a sample of 
+        different-meaning word pairs, from which phoneme surprisal is estimated"""
         random.seed(seed)
         #Take a sample of different-meaning words, as large as the same-meaning set
         sample_size = len(self.same_meaning)
@@ -402,90 +719,184 @@ class PhonemeCorrDetector:
                                                   p_threshold=p_threshold, 
                                                   seed=seed)
         
-        #Align same-meaning and different meaning word pairs using PMI values: 
-        #the alignments will remain the same throughout iteration
+        #Align same-meaning and different meaning word pairs using PMI values
         same_meaning_alignments = self.align_wordlist(self.same_meaning,
                                                       added_penalty_dict=self.pmi_dict)
         diff_meaning_alignments = self.align_wordlist(diff_sample,
                                                       added_penalty_dict=self.pmi_dict)
         
+        return same_meaning_alignments, diff_meaning_alignments
+    
+    def calc_phoneme_surprisal(self, radius=2, 
+                               max_iterations=10, 
+                               p_threshold=0.1,
+                               ngram_size=2,
+                               print_iterations=False,
+                               seed=1,
+                               save=True,
+                               alignments=None):
+        #METHOD
+        #1) Calculate phoneme PMI
+        #2) Use phoneme PMI to align 
+        #3) Iterate
+        
+        #Align same-meaning and different meaning word pairs using PMI values, if not provided: 
+        #the alignments will remain the same throughout iteration
+        if alignments == None:
+            alignments = self.surprisal_alignments(radius=radius, 
+                                                   max_iterations=max_iterations, 
+                                                   p_threshold=p_threshold, 
+                                                   seed=seed)
+        same_meaning_alignments, diff_meaning_alignments = alignments
+        
+        #Iteratively estimate surprisal from these alignments
+        results = self.fit_phoneme_surprisal([(self.lang1, self.lang2, self.same_meaning,
+                                               same_meaning_alignments, diff_meaning_alignments)],
+                                             max_iterations=max_iterations,
+                                             p_threshold=p_threshold,
+                                             ngram_size=ngram_size,
+                                             print_iterations=print_iterations)[0]
+        
+        #Save the final iteration's surprisal results
+        if save == True:
+            self.lang1.phoneme_surprisal[(self.lang2, ngram_size)] = results
+        self.surprisal_dict = results
+        
+        return results
+    
+    def calc_bidirectional_surprisal(self, radius=2, 
+                                     max_iterations=10, 
+                                     p_threshold=0.1,
+                                     ngram_size=2,
+                                     print_iterations=False,
+                                     seed=1,
+                                     save=True,
+                                     alignments=None):
+        """Calculates phoneme surprisal from language 1 to language 2 and from language 2 
+        to language 1 together, from a single PMI alignment of each word pair: the alignments 
+        of the second direction are the reversed alignments of the first.
+        Returns a tuple of the L1-->L2 and L2-->L1 surprisal dictionaries"""
+        
+        #Align same-meaning and different meaning word pairs using PMI values, if not provided: 
+        #the alignments will remain the same throughout iteration
+        if alignments == None:
+            alignments = self.surprisal_alignments(radius=radius, 
+                                                   max_iterations=max_iterations, 
+                                                   p_threshold=p_threshold, 
+                                                   seed=seed)
+        same_meaning_alignments, diff_meaning_alignments = alignments
+        
+        #Fit the surprisal of both directions in the same iterations
+        reversed_pairs = [(pair[1], pair[0]) for pair in self.same_meaning]
+        results_l1l2, results_l2l1 = self.fit_phoneme_surprisal([(self.lang1, self.lang2, self.same_meaning,
+                                                                  same_meaning_alignments, diff_meaning_alignments),
+                                                                 (self.lang2, self.lang1, reversed_pairs,
+                                                                  [reverse_alignment(alignment) for alignment in same_meaning_alignments],
+                                                                  [reverse_alignment(alignment) for alignment in diff_meaning_alignments])],
+                                                                max_iterations=max_iterations,
+                                                                p_threshold=p_threshold,
+                                                                ngram_size=ngram_size,
+                                                                print_iterations=print_iterations)
+        
+        #Save the final iteration's surprisal results
+        if save == True:
+            self.lang1.phoneme_surprisal[(self.lang2, ngram_size)] = results_l1l2
+            self.lang2.phoneme_surprisal[(self.lang1, ngram_size)] = results_l2l1
+        self.surprisal_dict = results_l1l2
+        
+        return results_l1l2, results_l2l1
+    
+    def fit_phoneme_surprisal(self, directions, max_iterations=10, p_threshold=0.1, 
+                              ngram_size=2, print_iterations=False):
+        """Iteratively estimates phoneme surprisal in one or more directions in the same loop.
+        directions : list of (l1, l2, word_pairs, same_meaning_alignments, diff_meaning_alignments)
+        tuples, with the word pairs and alignments of each direction running from l1 to l2
+        Returns a list of the final iteration's surprisal dictionary for each direction"""
+        
+        #Integer-code the ngram correspondences of the alignments once for batch scoring
+        coded_alignments = []
+        for l1, l2, word_pairs, same_meaning_alignments, diff_meaning_alignments in directions:
+            same_meaning_codes, same_meaning_lengths, correspondence_ids = encode_alignments(same_meaning_alignments, 
+                                                                                             ngram_size=ngram_size)
+            diff_meaning_codes, diff_meaning_lengths, correspondence_ids = encode_alignments(diff_meaning_alignments, 
+                                                                                             ngram_size=ngram_size,
+                                                                                             correspondence_ids=correspondence_ids)
+            coded_alignments.append((same_meaning_codes, same_meaning_lengths, 
+                                     diff_meaning_codes, diff_meaning_lengths, correspondence_ids))
+        
         #At each iteration, re-calculate surprisal for qualifying and disqualified pairs
         #Then test each same-meaning word pair to see if if it meets the qualifying threshold
+        #Each direction stops iterating once its qualifying word pairs no longer change
         iteration = 0
-        surprisal_iterations = {}
-        qualifying_words = default_dict({iteration:list(range(len(same_meaning_alignments)))}, l=[])
-        disqualified_words = defaultdict(lambda:[])
-        while (iteration < max_iterations) and (qualifying_words[iteration] != qualifying_words[iteration-1]):
+        surprisal_iterations = [{} for direction in directions]
+        qualifying_words = [default_dict({iteration:list(range(len(direction[3])))}, l=[]) for direction in directions]
+        disqualified_words = [defaultdict(lambda:[]) for direction in directions]
+        active = [d for d in range(len(directions)) 
+                  if qualifying_words[d][iteration] != qualifying_words[d][iteration-1]]
+        while (iteration < max_iterations) and (len(active) > 0):
             iteration += 1
-            
-            #Calculate surprisal from the qualifying alignments of the previous iteration
-            cognate_alignments = [same_meaning_alignments[i] for i in qualifying_words[iteration-1]]
-            surprisal_iterations[iteration] = self.phoneme_surprisal(self.correspondence_probs(cognate_alignments,
-                                                                                               counts=True,
-                                                                                               exclude_null=False, 
-                                                                                               ngram_size=ngram_size), 
-                                                                     ngram_size=ngram_size)
-            #Retrieve the alignments of different-meaning and disqualified word pairs
-            #and calculate adaptation surprisal for them using new surprisal values
-            noncognate_alignments = diff_meaning_alignments + [same_meaning_alignments[i]
-                                                               for i in disqualified_words[iteration-1]]
-            noncognate_surprisal = [adaptation_surprisal(alignment, 
-                                                         surprisal_dict=surprisal_iterations[iteration], 
-                                                         normalize=True,
-                                                         ngram_size=ngram_size) 
-                                    for alignment in noncognate_alignments]
-            
-            #Normalize different-meaning pair surprisal scores by self-surprisal of word2
-            # for i in range(len(noncognate_alignments)):
-            #     alignment = noncognate_alignments[i]
-            #     word2 = ''.join([pair[1] for pair in alignment if pair[1] != '-'])
-            #     self_surprisal = self.lang2.self_surprisal(word2, segmented=False, normalize=False)
-            #     noncognate_surprisal[i] /= self_surprisal
-
-            #Score same-meaning alignments for surprisal and calculate p-value
-            #against different-meaning alignments
-            qualifying, disqualified = [], []
-            for i in range(len(self.same_meaning)):
-                alignment = same_meaning_alignments[i]
-                item = self.same_meaning[i]
-                surprisal_score = adaptation_surprisal(alignment, 
-                                                       surprisal_dict=surprisal_iterations[iteration], 
-                                                       normalize=True,
-                                                       ngram_size=ngram_size)
-                segs2 = item[1][3]
-                #self_surprisal = self.lang2.self_surprisal(segs2, segmented=True, normalize=False)
-                #surprisal_score /= self_surprisal
-                p_value = (len([score for score in noncognate_surprisal if score <= surprisal_score])+1) / (len(noncognate_surprisal)+1)
-                if p_value < p_threshold:
-                    qualifying.append(i)
-                else:
-                    disqualified.append(i)
-            qualifying_words[iteration] = qualifying
-            disqualified_words[iteration] = disqualified
-            
-            #Print results of this iteration
-            if print_iterations == True:
-                print(f'Iteration {iteration}')
-                print(f'\tQualified: {len(qualifying)}')
-                added = [self.same_meaning[i] for i in qualifying_words[iteration]
-                         if i not in qualifying_words[iteration-1]]
-                for item in added:
-                    word1, word2 = item[0][1], item[1][1]
-                    ipa1, ipa2 = item[0][2], item[1][2]
-                    print(f'\t\t{word1} /{ipa1}/ - {word2} /{ipa2}/')
+            for d in active:
+                l1, l2, word_pairs, same_meaning_alignments, diff_meaning_alignments = directions[d]
+                same_meaning_codes, same_meaning_lengths, diff_meaning_codes, diff_meaning_lengths, correspondence_ids = coded_alignments[d]
                 
-                print(f'\tDisqualified: {len(disqualified)}')
-                removed = [self.same_meaning[i] for i in qualifying_words[iteration-1] 
-                           if i not in qualifying_words[iteration]]
-                for item in removed:
-                    word1, word2 = item[0][1], item[1][1]
-                    ipa1, ipa2 = item[0][2], item[1][2]
-                    print(f'\t\t{word1} /{ipa1}/ - {word2} /{ipa2}/')
-        
-        #Return and save the final iteration's surprisal results
-        results = surprisal_iterations[iteration]
-        if save == True:
-            self.lang1.phoneme_surprisal[(self.lang2, ngram_size)] = results
-        self.surprisal_dict = results
+                #Calculate surprisal from the qualifying alignments of the previous iteration
+                cognate_alignments = [same_meaning_alignments[i] for i in qualifying_words[d][iteration-1]]
+                surprisal_iterations[d][iteration] = self.phoneme_surprisal(self.correspondence_probs(cognate_alignments,
+                                                                                                      counts=True,
+                                                                                                      exclude_null=False, 
+                                                                                                      ngram_size=ngram_size), 
+                                                                            ngram_size=ngram_size,
+                                                                            l1=l1, l2=l2)
+                
+                #Calculate adaptation surprisal of same-meaning and different-meaning word pairs 
+                #using new surprisal values
+                surprisal_values = correspondence_surprisal(surprisal_iterations[d][iteration], correspondence_ids)
+                surprisal_scores = batch_adaptation_surprisal(same_meaning_codes, same_meaning_lengths, 
+                                                              surprisal_values, normalize=True)
+                diff_meaning_surprisal = batch_adaptation_surprisal(diff_meaning_codes, diff_meaning_lengths, 
+                                                                    surprisal_values, normalize=True)
+                
+                #Different-meaning and disqualified word pairs form the noncognate distribution
+                noncognate_surprisal = np.concatenate([diff_meaning_surprisal, 
+                                                       surprisal_scores[disqualified_words[d][iteration-1]]])
+                
+                #Score same-meaning alignments for surprisal and calculate p-value
+                #against different-meaning alignments
+                qualifying, disqualified = [], []
+                p_values = empirical_p_values(surprisal_scores, noncognate_surprisal, greater=False)
+                for i in range(len(word_pairs)):
+                    p_value = p_values[i]
+                    if p_value < p_threshold:
+                        qualifying.append(i)
+                    else:
+                        disqualified.append(i)
+                qualifying_words[d][iteration] = qualifying
+                disqualified_words[d][iteration] = disqualified
+                
+                #Print results of this iteration
+                if print_iterations == True:
+                    if len(directions) > 1:
+                        print(f'Iteration {iteration} ({l1.name} --> {l2.name})')
+                    else:
+                        print(f'Iteration {iteration}')
+                    print(f'\tQualified: {len(qualifying)}')
+                    added = [word_pairs[i] for i in qualifying_words[d][iteration]
+                             if i not in qualifying_words[d][iteration-1]]
+                    for item in added:
+                        word1, word2 = item[0][1], item[1][1]
+                        ipa1, ipa2 = item[0][2], item[1][2]
+                        print(f'\t\t{word1} /{ipa1}/ - {word2} /{ipa2}/')
+                    
+                    print(f'\tDisqualified: {len(disqualified)}')
+                    removed = [word_pairs[i] for i in qualifying_words[d][iteration-1] 
+                               if i not in qualifying_words[d][iteration]]
+                    for item in removed:
+                        word1, word2 = item[0][1], item[1][1]
+                        ipa1, ipa2 = item[0][2], item[1][2]
+                        print(f'\t\t{word1} /{ipa1}/ - {word2} /{ipa2}/')
+            
+            active = [d for d in active 
+                      if qualifying_words[d][iteration] != qualifying_words[d][iteration-1]]
         
-        return results
\ No newline at end of file
+        #Return the final iteration's surprisal results of each direction
+        return [surprisal_iterations[d][max(surprisal_iterations[d].keys())] for d in range(len(directions))]
\ No newline at end of file
@@ -3,18 +3,22 @@
 
 
 #LOAD REQUIRED PACKAGES AND FUNCTIONS
-import re, math, os
-import pandas as pd
+import re, math, os, pickle
+import numpy as np
 from collections import defaultdict
-from nltk import edit_distance
-from sklearn.metrics import jaccard_score
-from scipy.spatial.distance import cosine
 from statistics import mean
 from nwunsch_alignment import best_alignment 
 from auxiliary_functions import strip_ch
 
 #IMPORT SOUND DATA
-phone_data = pd.read_csv('Phones/segments.csv', sep=',')
+#The phone, phone class, diacritic and feature geometry tables are compiled from 
+#the CSV files into a single binary file, which is reloaded on import 
+#unless any of the CSV files have changed since it was written
+phone_table_files = ['Phones/segments.csv', 
+                     'Phones/phone_classes.csv',
+                     'Phones/diacritics.csv', 
+                     'Phones/feature_geometry.csv']
+phone_tables_file = 'Phones/phone_tables.pkl'
 
 def binary_feature(feature):
     """Converts features of type ['0', '-', '+'] to binary [0, 1]"""
@@ -23,30 +27,127 @@ def binary_feature(feature):
     else:
         return 0
 
+
+def compile_phone_tables():
+    """Reads the phone data CSV files and returns a dictionary of phone tables"""
+    import pandas as pd
+    
+    phone_data = pd.read_csv('Phones/segments.csv', sep=',')
+    
+    #Dictionary of basic phones with their phonetic features
+    phone_features = {phone_data['segment'][i]:{feature:binary_feature(phone_data[feature][i])
+                                              for feature in phone_data.columns
+                                              if feature not in ['segment',
+                                                                 #'stress',
+                                                                 #'tone',
+                                                                 'sonority']
+                                              if pd.isnull(phone_data[feature][i]) == False}
+                      for i in range(len(phone_data))}
+    
+    #Dictionary of basic phone with their sonority levels
+    phone_sonority = {phone_data['segment'][i]:int(phone_data['sonority'][i])
+                      for i in range(len(phone_data))}
+    
+    #Basic groupings of phones; e.g. plosive, fricative, velar, palatal
+    phone_classes = pd.read_csv('Phones/phone_classes.csv')
+    phone_groups = {phone_classes['Group'][i]:phone_classes['Phones'][i].split()
+                    for i in range(len(phone_classes))}
+    
+    #Dictionary of diacritic characters with affected features and values
+    diacritics_data = pd.read_csv('Phones/diacritics.csv', sep='\t')
+    diacritics_effects = defaultdict(lambda:[])
+    for i in range(len(diacritics_data)):
+        effect = (diacritics_data['Feature'][i], binary_feature(diacritics_data['Value'][i]))
+        
+        #Skip diacritics which have no effect on features
+        if type(effect[0]) != float:
+            
+            #Add to dictionary, with diacritic as key
+            diacritics_effects[diacritics_data['Diacritic'][i]].append(effect)
+    
+    #Suprasegmental diacritics
+    suprasegmental_diacritics = set(diacritics_data.Diacritic[i] 
+                                    for i in range(len(diacritics_data)) 
+                                    if diacritics_data.Type[i] == 'suprasegmental')
+    suprasegmental_diacritics.remove('ː') #don't include length as a suprasegmental
+    
+    #Diacritics by position with respect to base segments
+    pre_diacritics = set([diacritics_data['Diacritic'][i] 
+                          for i in range(len(diacritics_data))
+                          if diacritics_data['Position'][i] == 'pre'])
+    post_diacritics = set([diacritics_data['Diacritic'][i]
+                           for i in range(len(diacritics_data))
+                           if diacritics_data['Position'][i] == 'post'])
+    
+    #Feature Geometry Weights
+    #Feature weight calculated as ln(n_distinctions) / (tier**2)
+    #where n_distinctions = (n_sisters+1) + (n_descendants)
+    feature_geometry = pd.read_csv('Phones/feature_geometry.csv', sep='\t')
+    paths = [path.split(' | ') for path in feature_geometry['Path']]
+    tiers = [len(path) for path in paths]
+    parents = [path[-1] for path in paths]
+    n_sisters = defaultdict(lambda:0)
+    n_descendants = defaultdict(lambda:0)
+    for path, parent in zip(paths, parents):
+        n_sisters[parent] += 1
+        for node in set(path):
+            n_descendants[node] += 1
+    n_distinctions = [(n_sisters[parent] + 1) + n_descendants[feature]
+                      for feature, parent in zip(feature_geometry['Feature'], parents)]
+    weights = [math.log(n_distinctions[i]) / (tiers[i]**2) for i in range(len(feature_geometry))]
+    total_weights = sum(weights)
+    feature_weights = {feature:w/total_weights 
+                       for feature, w in zip(feature_geometry['Feature'], weights)}
+    
+    return {'phone_features':phone_features,
+            'phone_sonority':phone_sonority,
+            'phone_groups':phone_groups,
+            'diacritics_effects':dict(diacritics_effects),
+            'suprasegmental_diacritics':suprasegmental_diacritics,
+            'pre_diacritics':pre_diacritics,
+            'post_diacritics':post_diacritics,
+            'weights':weights,
+            'feature_weights':feature_weights}
+
+
+def load_phone_tables(recompile=False):
+    """Returns the dictionary of phone tables, loaded from the compiled binary file
+    if it is up to date with the CSV files; otherwise compiles and saves the tables"""
+    signature = [(file, os.path.getmtime(file), os.path.getsize(file)) 
+                 for file in phone_table_files]
+    if recompile == False:
+        try:
+            with open(phone_tables_file, 'rb') as f:
+                compiled = pickle.load(f)
+            if compiled['signature'] == signature:
+                return compiled['tables']
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+    
+    tables = compile_phone_tables()
+    try:
+        with open(phone_tables_file, 'wb') as f:
+            pickle.dump({'signature':signature, 'tables':tables}, f)
+    except OSError:
+        pass
+    return tables
+
+phone_tables = load_phone_tables()
+
 #Dictionary of basic phones with their phonetic features
-phone_features = {phone_data['segment'][i]:{feature:binary_feature(phone_data[feature][i])
-                                          for feature in phone_data.columns
-                                          if feature not in ['segment',
-                                                             #'stress',
-                                                             #'tone',
-                                                             'sonority']
-                                          if pd.isnull(phone_data[feature][i]) == False}
-                  for i in range(len(phone_data))}
+phone_features = phone_tables['phone_features']
 
 features = set(feature for sound in phone_features for feature in phone_features[sound])
 
 #%%
 #Dictionary of basic phone with their sonority levels
-phone_sonority = {phone_data['segment'][i]:int(phone_data['sonority'][i])
-                  for i in range(len(phone_data))}
+phone_sonority = phone_tables['phone_sonority']
 
 max_sonority = max(phone_sonority.values())
 
 #%%
 #Load basic groupings of phones; e.g. plosive, fricative, velar, palatal
-phone_groups = pd.read_csv('Phones/phone_classes.csv')
-phone_groups = {phone_groups['Group'][i]:phone_groups['Phones'][i].split()
-                for i in range(len(phone_groups))}
+phone_groups = phone_tables['phone_groups']
 
 #Set these phone groups as global variables so that they are callable by name
 globals().update(phone_groups)
@@ -62,34 +163,17 @@ all_sounds = list(set(vowels + consonants))
 
 #%%
 #IMPORT DIACRITICS DATA
-diacritics_data = pd.read_csv('Phones/diacritics.csv', sep='\t')
-
-#Create dictionary of diacritic characters with affected features and values
-diacritics_effects = defaultdict(lambda:[])
-for i in range(len(diacritics_data)):
-    effect = (diacritics_data['Feature'][i], binary_feature(diacritics_data['Value'][i]))
-    
-    #Skip diacritics which have no effect on features
-    if type(effect[0]) != float:
-        
-        #Add to dictionary, with diacritic as key
-        diacritics_effects[diacritics_data['Diacritic'][i]].append(effect)
+#Dictionary of diacritic characters with affected features and values
+diacritics_effects = defaultdict(lambda:[], phone_tables['diacritics_effects'])
 
 #Isolate suprasegmental diacritics
-suprasegmental_diacritics = set(diacritics_data.Diacritic[i] 
-                                for i in range(len(diacritics_data)) 
-                                if diacritics_data.Type[i] == 'suprasegmental')
-suprasegmental_diacritics.remove('ː') #don't include length as a suprasegmental
+suprasegmental_diacritics = phone_tables['suprasegmental_diacritics']
 
 
 #Diacritics by position with respect to base segments
 inter_diacritics = ['͡', '͜']
-pre_diacritics = set([diacritics_data['Diacritic'][i] 
-                      for i in range(len(diacritics_data))
-                      if diacritics_data['Position'][i] == 'pre'])
-post_diacritics = set([diacritics_data['Diacritic'][i]
-                       for i in range(len(diacritics_data))
-                       if diacritics_data['Position'][i] == 'post'])
+pre_diacritics = phone_tables['pre_diacritics']
+post_diacritics = phone_tables['post_diacritics']
 prepost_diacritics = {'ʰ', 'ʱ', 'ⁿ'} #diacritics which can appear before or after
 
 
@@ -126,6 +210,15 @@ def phone_id(segment):
         return phone_ids[segment]
     
     #Otherwise generate a new phone feature dictionary
+    #Add segment's feature dictionary to phone_ids; return the feature dictionary
+    seg_dict = build_phone_id(segment)
+    phone_ids[segment] = seg_dict
+    return seg_dict 
+
+
+def build_phone_id(segment):
+    """Generates a new dictionary of phonetic feature values for the segment 
+    from the phone feature tables"""
     seg_dict = defaultdict(lambda:0)
     
     #Split segment into component parts, if relevant
@@ -146,8 +239,6 @@ def phone_id(segment):
                 seg_dict['delayedRelease'] = 1 
                 seg_dict['continuant'] = 0 
     
-    #Add segment's feature dictionary to phone_ids; return the feature dictionary
-    phone_ids[segment] = seg_dict
     return seg_dict 
 
 
@@ -420,7 +511,7 @@ def prosodic_environment_weight(segments, i):
     #Word-initial segments
     if i == 0:
         #Word-initial consonants: weight 7
-        if strip_diacritics(segments[i])[0] in consonants:
+        if segment_class(segments[i]) == 'consonant':
             return 7
         
         #Word-initial vowels: weight 6
@@ -429,14 +520,14 @@ def prosodic_environment_weight(segments, i):
     
     #Word-final segments
     elif i == len(segments)-1:
-        stripped_segment = strip_diacritics(segments[i])[0]
+        seg_class = segment_class(segments[i])
         
         #Word-final consonants: weight 2
-        if stripped_segment in consonants:
+        if seg_class == 'consonant':
             return 2
         
         #Word-final vowels: weight 1
-        elif stripped_segment in vowels:
+        elif seg_class == 'vowel':
             return 1
         
         #Word-final tonemes: weight 0
@@ -464,90 +555,182 @@ def prosodic_environment_weight(segments, i):
 
 
 #WORD SEGMENTATION
+#Character class table used by segment_word, mapping each character to the
+#class which determines how it is grouped with neighbouring characters
+#(checked in this order of priority)
+PRE_DIACRITIC, BASE_SOUND, TONEME, PREPOST_DIACRITIC = 1, 2, 3, 4
+segment_ch_classes = {}
+for ch in prepost_diacritics:
+    segment_ch_classes[ch] = PREPOST_DIACRITIC
+for ch in tonemes:
+    segment_ch_classes[ch] = TONEME
+for ch in consonants+vowels:
+    segment_ch_classes[ch] = BASE_SOUND
+for ch in pre_diacritics:
+    segment_ch_classes[ch] = PRE_DIACRITIC
+diacritic_set = set(diacritics)
+toneme_set = set(tonemes)
+vowel_set = set(vowels)
+
 def segment_word(word, remove_ch=[]):
     """Returns a list of segmented phones from the word"""
     
     #Remove spaces and other specified characters/diacritics (e.g. stress)
-    word = ''.join([ch for ch in word if ch not in remove_ch+[' ']])
+    to_remove = set(remove_ch)
+    to_remove.add(' ')
+    word = ''.join([ch for ch in word if ch not in to_remove])
     
-    phone_list = defaultdict(lambda:[])
+    #Lists of characters of each segment, and of each segment's base characters (without diacritics)
+    phone_list, base_list = [], []
     
     #Iterate through all characters of the word
-    i = 0
     for ch in word:
+        ch_class = segment_ch_classes.get(ch, 0)
         
-        #If character is a preceding diacritic, add it to the next segment
-        #by incrementing the index by 1
-        if ch in pre_diacritics:
-            i += 1
+        #If character is a preceding diacritic, start a new segment with it
+        if ch_class == PRE_DIACRITIC:
+            new_segment = True
         
-        #Or, if there was a previous sound at the current index
-        elif i in phone_list:
+        #Or, if there was a previous sound
+        elif len(phone_list) > 0:
             
-            #Previous segment
-            prev = phone_list[i]
-            
-            #Last character of this previous segment
-            last = prev[-1]
+            #Last character of the previous segment
+            last = phone_list[-1][-1]
             
             #Base of this previous segment
-            prev_base = strip_diacritics(prev)
+            prev_base = base_list[-1]
             
-            #Increment index by 1 if the current character is a consonant or vowel
+            #Start a new segment if the current character is a consonant or vowel
             #AND if the last character of the previous sound was either
             #a post-diacritic or not a diacritic at all:
-            if ch in consonants+vowels:
+            if ch_class == BASE_SOUND:
                 if last in post_diacritics:
                     
-                    #Don't increment the index unless the previous segment
+                    #Don't start a new segment unless the previous segment
                     #consists of more than just a diacritic,
                     #which would be the case for pre-aspiration/pre-nasalization
-                    if len(prev_base) > 0:
-                        i += 1
+                    new_segment = len(prev_base) > 0
                     
-                elif last not in diacritics:
-                    i += 1
+                else:
+                    new_segment = last not in diacritic_set
             
-            #If the current character is a toneme, increment the index only
+            #If the current character is a toneme, start a new segment only
             #if the base of the previous sound was not a toneme
             #(in order to group sequences of tonemes and associated diacritics as a single segment)
-            elif ch in tonemes:
-                if prev_base[0] not in tonemes:
-                    i += 1
+            elif ch_class == TONEME:
+                new_segment = prev_base[0] not in toneme_set
             
             #If the character is a diacritic which could be either a pre- or post-diacritic
-            #Increment the index by 1 if the base of the previous sound is a vowel
+            #Start a new segment if the base of the previous sound is a vowel
             #In order to prevent pre-aspiration/nasalization to be added to a previous vowel
-            elif ch in prepost_diacritics:
-                if prev_base in vowels:
-                    i += 1
+            elif ch_class == PREPOST_DIACRITIC:
+                new_segment = ''.join(prev_base) in vowel_set
+            
+            else:
+                new_segment = False
         
-        #Add the character to the yielded index
-        phone_list[i].append(ch)
+        else:
+            new_segment = True
+        
+        #Add the character to the current or to a new segment
+        if new_segment == True:
+            phone_list.append([ch])
+            base_list.append([])
+        else:
+            phone_list[-1].append(ch)
+        if ch not in diacritic_set:
+            base_list[-1].append(ch)
     
     #Rejoin together all characters for each segment
-    for i in phone_list:
-        phone_list[i] = ''.join(phone_list[i])
-    
-    #Return a list of the segments
-    return list(phone_list.values())
+    return [''.join(phone) for phone in phone_list]
+
+
+def segment_words(words, remove_ch=[]):
+    """Returns a list of segmented phone lists for a sequence of words,
+    segmenting each distinct word only once"""
+    segmented = {}
+    for word in words:
+        if word not in segmented:
+            segmented[word] = segment_word(word, remove_ch=remove_ch)
+    return [list(segmented[word]) for word in words]
 
 def remove_stress(word):
     """Removes stress annotation from an IPA string"""
     return ''.join([ch for ch in word if ch not in ['ˈ', 'ˌ']])
 
 #%%
+#INVERTED FEATURE INDEX
+#Segments are assigned integer IDs as they are indexed; each (feature, value) pair
+#is mapped to a bitset of the IDs of the segments with that value, 
+#and each segment's feature values are stored as a row for shared feature queries
+feature_columns = {feature:i for i, feature in enumerate(sorted(features))}
+indexed_segments = {}
+indexed_segment_list = []
+segment_feature_rows = []
+feature_value_index = defaultdict(lambda:0)
+
+def index_segments(segment_list):
+    """Adds any segments not yet indexed to the inverted feature index"""
+    for segment in segment_list:
+        if segment not in indexed_segments:
+            seg_id = phone_id(segment)
+            seg_bit = 1 << len(indexed_segments)
+            indexed_segments[segment] = len(indexed_segments)
+            indexed_segment_list.append(segment)
+            row = np.zeros(len(feature_columns))
+            for feature in feature_columns:
+                value = seg_id.get(feature, 0)
+                row[feature_columns[feature]] = value
+                feature_value_index[(feature, value)] |= seg_bit
+            segment_feature_rows.append(row)
+
+
+segment_bitsets = {}
+def segments_bitset(segment_list):
+    """Returns the bitset of the IDs of the (indexed) segments"""
+    segment_tuple = tuple(segment_list)
+    if segment_tuple not in segment_bitsets:
+        bitset = 0
+        for segment in segment_tuple:
+            bitset |= 1 << indexed_segments[segment]
+        segment_bitsets[segment_tuple] = bitset
+    return segment_bitsets[segment_tuple]
+
+
+def bitset_segments(bitset):
+    """Returns the set of indexed segments whose IDs are in the bitset"""
+    segments = set()
+    while bitset > 0:
+        lowest_bit = bitset & -bitset
+        segments.add(indexed_segment_list[lowest_bit.bit_length() - 1])
+        bitset ^= lowest_bit
+    return segments
+
+
 def common_features(segment_list, 
                     start_features=features):
     """Returns the features/values shared by all segments in the list"""
-    features = list(start_features)[:]
-    feature_values = defaultdict(lambda:[])
-    for seg in segment_list:
-        for feature in features:
-            value = phone_id(seg)[feature]
-            if value not in feature_values[feature]:
-                feature_values[feature].append(value)
-    common = [(feature, feature_values[feature][0]) for feature in feature_values if len(feature_values[feature]) == 1]
+    segment_list = list(segment_list)
+    if len(segment_list) == 0:
+        return []
+    index_segments(segment_list)
+    
+    #Features whose values in all segments are equal to those of the first segment
+    rows = np.array([segment_feature_rows[indexed_segments[seg]] for seg in segment_list])
+    shared = (rows == rows[0]).all(axis=0)
+    
+    first_id = phone_id(segment_list[0])
+    common = []
+    for feature in dict.fromkeys(start_features):
+        if feature in feature_columns:
+            if shared[feature_columns[feature]] == True:
+                common.append((feature, first_id.get(feature, 0)))
+        
+        #Features outside of the index are compared segment by segment
+        else:
+            values = [phone_id(seg)[feature] for seg in segment_list]
+            if all(value == values[0] for value in values):
+                common.append((feature, values[0]))
     return common
 
 def different_features(seg1, seg2, return_list=False):
@@ -568,21 +751,29 @@ def different_features(seg1, seg2, return_list=False):
 def lookup_segments(features, values, 
                     segment_list=all_sounds):
     """Returns a list of segments whose feature values match the search criteria"""
-    matches = []
-    for segment in segment_list:
-        match_tallies = 0
-        for feature, value in zip(features, values):
-            if phone_id(segment)[feature] == value:
-                match_tallies += 1
-        if match_tallies == len(features):
-            matches.append(segment)
-    return set(matches)
+    if len(values) < len(features):
+        return set()
+    index_segments(segment_list)
+    
+    #Intersect the bitsets of the segments with each of the feature values
+    matches = segments_bitset(segment_list)
+    for feature, value in zip(features, values):
+        if feature in feature_columns:
+            matches &= feature_value_index.get((feature, value), 0)
+        else:
+            matches &= segments_bitset([segment for segment in segment_list
+                                        if phone_id(segment)[feature] == value])
+    
+    return bitset_segments(matches)
 
 #%%
 
 #SIMILARITY / DISTANCE MEASURES
 
-#Cosine similarity: cosine() imported from scipy.spatial.distance
+def cosine(vec1, vec2, w=None):
+    """Returns the cosine distance between two vectors (scipy.spatial.distance.cosine)"""
+    from scipy.spatial.distance import cosine as cosine_distance
+    return cosine_distance(vec1, vec2, w=w)
 
 def hamming_distance(vec1, vec2, normalize=True):
     differences = len([feature for feature in vec1 if vec1[feature] != vec2[feature]])
@@ -592,6 +783,7 @@ def hamming_distance(vec1, vec2, normalize=True):
         return differences
 
 def jaccard_sim(vec1, vec2):
+    from sklearn.metrics import jaccard_score
     features = sorted(list(vec1.keys()))
     vec1_values = [vec1[feature] for feature in features]
     vec2_values = [vec2[feature] for feature in features]
@@ -610,22 +802,11 @@ def dice_sim(vec1, vec2):
     return (2*jaccard) / (1+jaccard)
 
 
-#Feature Geometry Weights
-#Feature weight calculated as ln(n_distinctions) / (tier**2)
-#where n_distinctions = (n_sisters+1) + (n_descendants)
-feature_geometry = pd.read_csv('Phones/feature_geometry.csv', sep='\t')
-feature_geometry['Tier'] = feature_geometry['Path'].apply(lambda x: len(x.split(' | ')))
-feature_geometry['Parent'] = feature_geometry['Path'].apply(lambda x: x.split(' | ')[-1])
-feature_geometry['N_Sisters'] = feature_geometry['Parent'].apply(lambda x: feature_geometry['Parent'].to_list().count(x))
-feature_geometry['N_Descendants'] = feature_geometry['Feature'].apply(lambda x: len([i for i in range(len(feature_geometry)) 
-                                                                                     if x in feature_geometry['Path'].to_list()[i].split(' | ')]))
-feature_geometry['N_Distinctions'] = (feature_geometry['N_Sisters'] + 1) + (feature_geometry['N_Descendants'])
-weights = [math.log(row['N_Distinctions']) / (row['Tier']**2) for index, row in feature_geometry.iterrows()]
+#Feature Geometry Weights (see compile_phone_tables)
+weights = phone_tables['weights']
 total_weights = sum(weights)
 normalized_weights = [w/total_weights for w in weights]
-feature_geometry['Weight'] = normalized_weights
-feature_weights = {feature_geometry.Feature.to_list()[i]:feature_geometry.Weight.to_list()[i]
-                   for i in range(len(feature_geometry))}
+feature_weights = phone_tables['feature_weights']
 
 
 def weighted_hamming(vec1, vec2, weights=feature_weights):
@@ -651,10 +832,105 @@ def weighted_dice(vec1, vec2, weights=feature_weights):
     return (2*w_jaccard) / (1+w_jaccard)
 
 
+#BITSET FEATURE ENCODING
+#Phones whose feature values are all binary are also encoded as integer bitmasks
+#(one bit per feature), so that the binary measures can be computed by counting bits;
+#phones with continuous feature values (e.g. diphthongs) use their feature dictionaries
+#Bits are assigned in the order of the phone tables' feature columns, which is the order 
+#in which the feature dictionaries are iterated
+feature_list = list(dict.fromkeys([feature for phone in phone_features for feature in phone_features[phone]]
+                                  + list(feature_weights.keys())))
+feature_bits = {feature:i for i, feature in enumerate(feature_list)}
+bit_weights = [feature_weights.get(feature, 0) for feature in feature_list]
+
+
+def popcount(mask):
+    """Returns the number of set bits in an integer bitmask"""
+    return bin(mask).count('1')
+
+
+def mask_weight(mask):
+    """Returns the summed weights of the features set in a bitmask, added one by one 
+    in feature order as the weighted measures do, so that the results are identical"""
+    total = 0
+    while mask:
+        bit = mask & -mask
+        total += bit_weights[bit.bit_length()-1]
+        mask ^= bit
+    return total
+
+
+phone_bitsets = {}
+def phone_bitset(segment):
+    """Returns a tuple of the bitmask of features defined for the segment, 
+    the bitmask of its features with value 1, and its number of features;
+    returns None if any of its feature values are continuous, or if its features 
+    are not in table order (so that weighted sums could be added in a different order)"""
+    if segment in phone_bitsets:
+        return phone_bitsets[segment]
+    
+    #Encode the features of a newly generated feature dictionary, rather than 
+    #the cached one from phone_id, which gains entries when missing features are read
+    seg_id = build_phone_id(segment)
+    defined, positive = 0, 0
+    for feature in seg_id:
+        value = seg_id[feature]
+        if (feature not in feature_bits) or (value not in [0, 1]) or (defined >> feature_bits[feature] != 0):
+            phone_bitsets[segment] = None
+            return None
+        defined |= 1 << feature_bits[feature]
+        if value == 1:
+            positive |= 1 << feature_bits[feature]
+    
+    phone_bitsets[segment] = (defined, positive, len(seg_id))
+    return phone_bitsets[segment]
+
+
+def feature_mask(exclude_features=[]):
+    """Returns a bitmask of all features except the excluded features"""
+    mask = (1 << len(feature_list)) - 1
+    for feature in exclude_features:
+        if feature in feature_bits:
+            mask &= ~(1 << feature_bits[feature])
+    return mask
+
+
+def bitset_sim(bitset1, bitset2, similarity, mask=None):
+    """Returns the value of the binary similarity/distance measure for two 
+    phone bitsets defining the same features (see phone_sim);
+    if a feature mask is given, only the features in the mask are compared"""
+    positive1, positive2, n_features = bitset1[1], bitset2[1], bitset1[2]
+    if mask != None:
+        positive1, positive2 = positive1 & mask, positive2 & mask
+        n_features = popcount(bitset1[0] & mask)
+    if similarity in ['jaccard', 'dice']:
+        union = popcount(positive1 | positive2)
+        score = popcount(positive1 & positive2) / union if union > 0 else 0.0
+    elif similarity in ['weighted_jaccard', 'weighted_dice']:
+        score = mask_weight(positive1 & positive2) / mask_weight(positive1 | positive2)
+    elif similarity == 'hamming':
+        return popcount(positive1 ^ positive2) / n_features
+    elif similarity == 'weighted_hamming':
+        return mask_weight(positive1 ^ positive2) / n_features
+    if similarity in ['dice', 'weighted_dice']:
+        score = (2*score) / (1+score)
+    return score
+
+
 
 
 
 #PHONE COMPARISON
+def masked_phone_id(segment, exclude_features):
+    """Returns a copy of the segment's feature dictionary without the excluded features"""
+    seg_id = phone_id(segment)
+    masked_id = defaultdict(lambda:0)
+    for feature in seg_id:
+        if feature not in exclude_features:
+            masked_id[feature] = seg_id[feature]
+    return masked_id
+
+
 checked_phone_sims = {}
 def phone_sim(phone1, phone2, similarity='weighted_dice', exclude_features=[]):
     """Returns the similarity of the features of the two phones according to
@@ -667,16 +943,14 @@ def phone_sim(phone1, phone2, similarity='weighted_dice', exclude_features=[]):
     if reference in checked_phone_sims:
         return checked_phone_sims[reference]
     
-    #Get feature dictionaries for each phone
-    phone_id1, phone_id2 = phone_id(phone1), phone_id(phone2)
-    
-    #Remove any specified features
-    for feature in exclude_features:
-        for phoneid in [phone_id1, phone_id2]:
-            try:
-                del phoneid[feature]
-            except KeyError:
-                pass
+    #Get feature dictionaries for each phone, 
+    #with any specified features removed from copies of the dictionaries
+    if len(exclude_features) > 0:
+        phone_id1 = masked_phone_id(phone1, exclude_features)
+        phone_id2 = masked_phone_id(phone2, exclude_features)
+    else:
+        phone_id1, phone_id2 = phone_id(phone1), phone_id(phone2)
+    mask = feature_mask(exclude_features)
 
     #Calculate similarity of phone features according to specified measure
     measures = {'cosine':cosine,
@@ -694,7 +968,12 @@ def phone_sim(phone1, phone2, similarity='weighted_dice', exclude_features=[]):
         raise KeyError
     
     if similarity not in ['cosine', 'weighted_cosine']:
-        score = measure(phone_id1, phone_id2)
+        #Compare the phones' bitsets if both are binary and define the same features
+        bitset1, bitset2 = phone_bitset(phone1), phone_bitset(phone2)
+        if (bitset1 != None) and (bitset2 != None) and ((bitset1[0] & mask) == (bitset2[0] & mask)):
+            score = bitset_sim(bitset1, bitset2, similarity, mask=mask)
+        else:
+            score = measure(phone_id1, phone_id2)
     else:
         compare_features = list(phone_id1.keys())
         phone1_values = [phone_id1[feature] for feature in compare_features]
@@ -715,6 +994,38 @@ def phone_sim(phone1, phone2, similarity='weighted_dice', exclude_features=[]):
     checked_phone_sims[reference] = score
     return score
 
+
+phone_sim_matrices = {}
+def phone_sim_matrix(phones, similarity='weighted_dice', exclude_features=[]):
+    """Returns the matrix of pairwise similarities of the phones (see phone_sim);
+    a separate matrix is cached for each measure and set of excluded features, 
+    and extended with any phones not yet included"""
+    key = (similarity, tuple(sorted(set(exclude_features))))
+    if key not in phone_sim_matrices:
+        phone_sim_matrices[key] = ({}, np.zeros((0, 0)))
+    index, matrix = phone_sim_matrices[key]
+    
+    #Calculate the similarities of any new phones to all phones in the matrix
+    new_phones = [phone for phone in dict.fromkeys(phones) if phone not in index]
+    if len(new_phones) > 0:
+        n_old = len(index)
+        for phone in new_phones:
+            index[phone] = len(index)
+        indexed_phones = list(index.keys())
+        extended = np.zeros((len(index), len(index)))
+        extended[:n_old, :n_old] = matrix
+        for i, phone1 in enumerate(indexed_phones):
+            for j, phone2 in enumerate(indexed_phones):
+                if (i >= n_old) or (j >= n_old):
+                    extended[i, j] = phone_sim(phone1, phone2, 
+                                               similarity=similarity, 
+                                               exclude_features=exclude_features)
+        matrix = extended
+        phone_sim_matrices[key] = (index, matrix)
+    
+    phone_indices = [index[phone] for phone in phones]
+    return matrix[np.ix_(phone_indices, phone_indices)]
+
 def compare_measures(seg1, seg2):
     measures = {}
     for dist_func in ['cosine', 'hamming', 'jaccard', 'dice', 
@@ -724,6 +1035,25 @@ def compare_measures(seg1, seg2):
 
 
 #WORD-LEVEL PHONETIC COMPARISON AND ALIGNMENT'
+segment_classes = {}
+def segment_class(segment):
+    """Returns the class of the segment's first base character: 
+    'consonant', 'vowel', 'toneme', or None if it is none of these"""
+    if segment in segment_classes:
+        return segment_classes[segment]
+    base = strip_diacritics(segment)[0]
+    if base in consonants:
+        seg_class = 'consonant'
+    elif base in vowels:
+        seg_class = 'vowel'
+    elif base in tonemes:
+        seg_class = 'toneme'
+    else:
+        seg_class = None
+    segment_classes[segment] = seg_class
+    return seg_class
+
+
 def compatible_segments(seg1, seg2):
     """Returns True if the two segments are either:
         two consonants
@@ -731,21 +1061,21 @@ def compatible_segments(seg1, seg2):
         a vowel and a sonorant consonant (nasals, liquids, glides)
         two tonemes
     Else returns False"""
-    strip_seg1, strip_seg2 = map(strip_diacritics, [seg1, seg2])
-    if strip_seg1[0] in consonants:
-        if strip_seg2[0] in consonants:
+    class1, class2 = segment_class(seg1), segment_class(seg2)
+    if class1 == 'consonant':
+        if class2 == 'consonant':
             return True
-        elif strip_seg2[0] in vowels:
+        elif class2 == 'vowel':
             if phone_id(seg1)['sonorant'] == 1:
                 return True
             else:
                 return False
         else:
             return False
-    elif strip_seg1[0] in vowels:
-        if strip_seg2[0] in vowels:
+    elif class1 == 'vowel':
+        if class2 == 'vowel':
             return True
-        elif strip_seg2[0] in consonants:
+        elif class2 == 'consonant':
             if phone_id(seg2)['sonorant'] == 1:
                 return True
             else:
@@ -754,11 +1084,18 @@ def compatible_segments(seg1, seg2):
             return False
     #Tonemes
     else: 
-        if strip_seg2[0] in tonemes:
+        if class2 == 'toneme':
             return True
         else:
             return False
 
+
+def compatibility_matrix(segments1, segments2):
+    """Returns a boolean matrix of whether each segment of the first list
+    is compatible with each segment of the second list (see compatible_segments)"""
+    return np.array([[compatible_segments(seg1, seg2) for seg2 in segments2]
+                     for seg1 in segments1], dtype=bool).reshape(len(segments1), len(segments2))
+
 def align_costs(seq1, seq2, 
                 dist_func, sim=False, 
                 **kwargs):
@@ -0,0 +1,55 @@
+import os, sys
+from collections import defaultdict
+
+#The phone tables are loaded from paths relative to the Code directory
+code_dir = os.path.dirname(os.path.abspath(__file__))
+os.chdir(code_dir)
+sys.path.insert(0, code_dir)
+from phonetic_distance import *
+
+
+#Phones from the phone tables, with diacritics and as affricates
+test_phones = list(phone_features.keys()) + ['pʰ', 'tʃ', 't͡ʃ', 'd͡ʒ', 'ɪ̯', 'kʷ', 'n̩', 'aː', 'bʲ']
+
+
+def dict_phone_sim(phone1, phone2, similarity):
+    """Returns the similarity of the two phones computed from their feature dictionaries"""
+    measures = {'weighted_dice':weighted_dice,
+                'weighted_jaccard':weighted_jaccard,
+                'weighted_hamming':weighted_hamming}
+    score = measures[similarity](phone_id(phone1), phone_id(phone2))
+    if similarity == 'weighted_hamming':
+        score = 1 - score
+    return score
+
+
+def test_weighted_bitset_sims_identical_to_dict_sims():
+    """The bitset encoding of the weighted measures must give exactly the same
+    values as the feature dictionaries, since alignments can depend on ties"""
+    phones = [phone for phone in test_phones if phone_bitset(phone) != None]
+    assert len(phones) > 100
+    for similarity in ['weighted_dice', 'weighted_jaccard', 'weighted_hamming']:
+        for phone1 in phones:
+            for phone2 in phones:
+                assert phone_sim(phone1, phone2, similarity) == dict_phone_sim(phone1, phone2, similarity), (phone1, phone2, similarity)
+
+
+def test_pmi_alignment_unchanged():
+    """Alignment of an Ancient Attic Greek and Ancient Ionic Greek word pair with
+    their phoneme PMI, which depends on a tie between weighted phone similarities"""
+    pmi = defaultdict(lambda:defaultdict(lambda:0))
+    pmi['a'].update({'a':2.5559645710537215, 'e':2.2204460492503128e-16, 'i':2.2204460492503128e-16,
+                     'j':2.2204460492503128e-16, 'm':2.2204460492503128e-16, 'p':2.2204460492503128e-16,
+                     's':2.2204460492503128e-16, 't':2.2204460492503128e-16})
+    pmi['d'].update({'a':2.2204460492503128e-16, 'e':2.2204460492503128e-16, 'i':2.2204460492503128e-16,
+                     'j':2.2204460492503128e-16, 's':2.2204460492503128e-16})
+    pmi['j'].update({'a':-2.2204460492503136e-16, 'i':-2.2204460492503136e-16, 'j':3.272642249023861,
+                     'm':-1.1102230246251565e-16, 't':-2.2204460492503136e-16})
+    pmi['o'].update({'a':-1.4143273424984, 'e':4.440892098500625e-16, 'i':4.440892098500625e-16,
+                     'j':4.440892098500625e-16, 'm':4.440892098500625e-16, 'p':4.440892098500625e-16,
+                     's':4.440892098500625e-16, 't':4.440892098500625e-16})
+
+    alignment = phone_align(['o', 'j', 'd', 'a'], ['e', 'p', 'i', 's', 't', 'a', 'm', 'a', 'j'],
+                            added_penalty_dict=pmi)
+    assert alignment == [('o', 'e'), ('-', 'p'), ('j', 'i'), ('-', 's'), ('d', 't'),
+                         ('a', 'a'), ('-', 'm'), ('-', 'a'), ('-', 'j')]
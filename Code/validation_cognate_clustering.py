@@ -17,7 +17,7 @@ def evaluate_parameters(family, parameters,
                         if len(family.concepts[concept]) > 1]
     else:
         concept_list = [concept for concept in concept_list 
-                        if len(family.concepts[concept]) > 1]
+                        if len(family.concepts.get(concept, {})) > 1]
     
     #Following section accomplishes same as family.cluster_cognates function,
     #but in a more efficient way that doesn't require the linkage matrix to be
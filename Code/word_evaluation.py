@@ -2,7 +2,6 @@ from phonetic_distance import *
 from phoneme_correspondences import PhonemeCorrDetector
 from auxiliary_functions import strip_ch, euclidean_dist, surprisal, adaptation_surprisal
 from asjp import ipa2asjp
-from nltk import edit_distance
 
 
 def prepare_alignment(item1, item2, **kwargs):
@@ -28,8 +27,13 @@ def prepare_alignment(item1, item2, **kwargs):
         word1, word2 = item1, item2
         lang1, lang2 = None, None
         
+    #If language input has been given without further alignment parameters, 
+    #retrieve the PMI-supported alignment shared with the other word pair measures
+    if ((lang1, lang2) != (None, None)) and (len(kwargs) == 0):
+        alignment = word_pair_context(item1, item2).phonetic_alignment()
+    
     #If language input has been given, incorporate their phoneme PMI for the alignment
-    if (lang1, lang2) != (None, None):
+    elif (lang1, lang2) != (None, None):
         
         #Check whether phoneme PMI has been calculated for this language pair
         #If not, then calculate it; if so, then retrieve it
@@ -77,6 +81,31 @@ def basic_word_sim(word1, word2=None, sim_func=phone_sim, **kwargs):
     return mean(phone_sims)
 
 
+def alignment_profile(alignment, side, sonority=True, prosodic_weights=True):
+    """Returns a dictionary describing one side (0 or 1) of an alignment in a 
+    single pass:
+        segments : list of the side's segments without gaps
+        positions : index of each alignment pair's segment within the ungapped 
+                    segment list (None for gaps)
+        sonority : sonority of each ungapped segment
+        prosodic_weights : prosodic environment weight of each ungapped segment"""
+    segments, positions = [], []
+    for pair in alignment:
+        if pair[side] != '-':
+            positions.append(len(segments))
+            segments.append(pair[side])
+        else:
+            positions.append(None)
+    
+    profile = {'segments':segments, 'positions':positions}
+    if sonority == True:
+        profile['sonority'] = [get_sonority(seg) for seg in segments]
+    if prosodic_weights == True:
+        profile['prosodic_weights'] = [prosodic_environment_weight(segments, i) 
+                                       for i in range(len(segments))]
+    return profile
+
+
 calculated_word_sims = {}
 def word_sim(word1, word2=None, 
               sim_func=phone_sim,
@@ -106,6 +135,15 @@ def word_sim(word1, word2=None,
         return calculated_word_sims[(tuple(alignment), sim_func, penalize_sonority, 
                                      context_reduction, prosodic_env_scaling, total_sim)] 
     else:
+        #Profile each side of the alignment which contains deleted segments:
+        #ungapped segment list, positions, sonority and prosodic weights
+        profiles = {}
+        for side in [0, 1]:
+            if any(pair[1-side] == '-' for pair in alignment):
+                profiles[side] = alignment_profile(alignment, side, 
+                                                   sonority=penalize_sonority,
+                                                   prosodic_weights=prosodic_env_scaling)
+        
         #Get list of penalties
         penalties = []
         for i in range(len(alignment)):
@@ -118,24 +156,23 @@ def word_sim(word1, word2=None,
                 penalty = 1
                 if seg1 == '-':
                     deleted_segment = seg2
-                    index = len([alignment[j][1] for j in range(i) if alignment[j][1] != '-'])
-                    
+                    deleted_index = 1
                 else:
                     deleted_segment = seg1
-                    index = len([alignment[j][0] for j in range(i) if alignment[j][0] != '-'])
+                    deleted_index = 0
+                gap_index = deleted_index-1
+                profile = profiles[deleted_index]
+                deleted_i = profile['positions'][i]
                 
                 if penalize_sonority == True:
-                    sonority = get_sonority(deleted_segment)
+                    sonority = profile['sonority'][deleted_i]
                     sonority_penalty = 1-(sonority/(max_sonority+1))
                     penalty *= sonority_penalty
                 
-                deleted_index = pair.index(deleted_segment)
-                gap_index = deleted_index-1
-                
                 #Lessen the penalty under certain circumstances
                 if context_reduction == True:
-                    stripped_deleted = strip_diacritics(deleted_segment)
                     if i > 0:
+                        stripped_deleted = strip_diacritics(deleted_segment)
                         previous_seg = alignment[i-1][gap_index]
                         #1) If the deleted segment is a nasal and the corresponding 
                         #precending segment was nasalized
@@ -143,51 +180,48 @@ def word_sim(word1, word2=None,
                             if '̃' in previous_seg: #check for nasalization diacritic:
                                 penalty /= penalty_discount
                         
-                        #2) If the deleted segment is a palatal glide (j, ɥ, i̯, ɪ̯),  
-                        #and the corresponding preceding segment was palatalized
-                        #or is a palatal consonant
-                        elif strip_diacritics(deleted_segment, excepted=['̯']) in {'j', 'ɥ', 
-                                                                                   'i̯', 'ɪ̯'}:
-                            if strip_diacritics(previous_seg)[0] in palatal:
-                                penalty /= penalty_discount
-                            elif ('ʲ' in previous_seg) or ('ᶣ' in previous_seg):
-                                penalty /= penalty_discount
-                                
-                        #3) If the deleted segment is a high rounded/labial glide
-                        #and the corresponding preceding segment was labialized
-                        elif strip_diacritics(deleted_segment, excepted=['̯']) in {'w', 'ʍ', 'ʋ', 
-                                                                                   'u', 'ʊ', 
-                                                                                   'y', 'ʏ'}:
-                            if ('ʷ' in previous_seg) or ('ᶣ' in previous_seg):
-                                penalty /= penalty_discount
+                        else:
+                            stripped_glide = strip_diacritics(deleted_segment, excepted=['̯'])
                         
-                        #4) If the deleted segment is /h, ɦ/ and the corresponding 
-                        #preceding segment was aspirated or breathy
-                        elif stripped_deleted in {'h', 'ɦ'}:
-                            if ('ʰ' in previous_seg) or ('ʱ' in previous_seg) or ('̤' in previous_seg):
-                                penalty /= penalty_discount
-                        
-                            #Or if the following corresponding segment is breathy or
-                            #pre-aspirated
-                            else:
-                                try:
+                            #2) If the deleted segment is a palatal glide (j, ɥ, i̯, ɪ̯),  
+                            #and the corresponding preceding segment was palatalized
+                            #or is a palatal consonant
+                            if stripped_glide in {'j', 'ɥ', 'i̯', 'ɪ̯'}:
+                                if strip_diacritics(previous_seg)[0] in palatal:
+                                    penalty /= penalty_discount
+                                elif ('ʲ' in previous_seg) or ('ᶣ' in previous_seg):
+                                    penalty /= penalty_discount
+                                    
+                            #3) If the deleted segment is a high rounded/labial glide
+                            #and the corresponding preceding segment was labialized
+                            elif stripped_glide in {'w', 'ʍ', 'ʋ', 'u', 'ʊ', 'y', 'ʏ'}:
+                                if ('ʷ' in previous_seg) or ('ᶣ' in previous_seg):
+                                    penalty /= penalty_discount
+                            
+                            #4) If the deleted segment is /h, ɦ/ and the corresponding 
+                            #preceding segment was aspirated or breathy
+                            elif stripped_deleted in {'h', 'ɦ'}:
+                                if ('ʰ' in previous_seg) or ('ʱ' in previous_seg) or ('̤' in previous_seg):
+                                    penalty /= penalty_discount
+                            
+                                #Or if the following corresponding segment is breathy or
+                                #pre-aspirated
+                                elif i+1 < len(alignment):
                                     next_seg = alignment[i+1][gap_index]
                                     if ('̤' in next_seg) or (next_seg[0] in {'ʰ', 'ʱ'}):
                                         penalty /= penalty_discount
-                                except IndexError:
-                                    pass
+                                
+                            #5) If the deleted segment is a rhotic approximant /ɹ, ɻ/
+                            #and the corresponding preceding segment was rhoticized
+                            elif stripped_deleted in {'ɹ', 'ɻ'}:
+                                if (strip_diacritics(previous_seg) == 'ɚ') or ('˞' in previous_seg):
+                                    penalty /= penalty_discount
                             
-                        #5) If the deleted segment is a rhotic approximant /ɹ, ɻ/
-                        #and the corresponding preceding segment was rhoticized
-                        elif stripped_deleted in {'ɹ', 'ɻ'}:
-                            if (strip_diacritics(previous_seg) == 'ɚ') or ('˞' in previous_seg):
-                                penalty /= penalty_discount
-                        
-                        #6) If the deleted segment is a glottal stop and the corresponding
-                        #preceding segment was glottalized (or creaky?)
-                        elif stripped_deleted == 'ʔ':
-                            if 'ˀ' in previous_seg:
-                                penalty /= penalty_discount
+                            #6) If the deleted segment is a glottal stop and the corresponding
+                            #preceding segment was glottalized (or creaky?)
+                            elif stripped_deleted == 'ʔ':
+                                if 'ˀ' in previous_seg:
+                                    penalty /= penalty_discount
                         
                         
                     #6) if the deleted segment is part of a long/geminate segment represented as double (e.g. /tt/ rather than /tː/), 
@@ -195,7 +229,7 @@ def word_sim(word1, word2=None,
                     #Method: check if the preceding or following pair contained the deleted segment at deleted_index, aligned to something other than the gap character
                     #Check following pair
                     double = False
-                    try:
+                    if i+1 < len(alignment):
                         nxt_pair = alignment[i+1]
                         if '-' not in nxt_pair:
                             if nxt_pair[deleted_index] == deleted_segment:
@@ -205,9 +239,6 @@ def word_sim(word1, word2=None,
                                 #is simply transcribed differently (see example below)
                                 if ('ː' in nxt_pair[gap_index]) or ('ˑ' in nxt_pair[gap_index]):
                                     penalty = 0
-                            
-                    except IndexError:
-                        pass
                     
                     #Check preceding pair
                     if i > 0:
@@ -228,11 +259,7 @@ def word_sim(word1, word2=None,
                 if prosodic_env_scaling == True:
                     #Discount deletion penalty according to prosodic sonority 
                     #environment (based on List, 2012)
-                    deleted_i = sum([1 for j in range(i+1) if alignment[j][deleted_index] != '-'])-1
-                    segment_list = [alignment[j][deleted_index] 
-                                    for j in range(len(alignment))
-                                    if alignment[j][deleted_index] != '-']
-                    prosodic_env_weight = prosodic_environment_weight(segment_list, deleted_i)
+                    prosodic_env_weight = profile['prosodic_weights'][deleted_i]
                     penalty /= math.sqrt(abs(prosodic_env_weight-7)+1)
                 
                 
@@ -267,6 +294,7 @@ def segmental_word_sim(word1, word2=None,
     """Calculates the phonetic similarity of an aligned word pair according to
     weighted average similarity of consonantal segments, vocalic segments, and 
     syllable structure"""
+    from nltk import edit_distance
     
     assert round(sum([c_weight, v_weight, syl_weight]),1) == 1.0
     
@@ -333,61 +361,132 @@ def segmental_word_sim(word1, word2=None,
 #%%
 
 
-combined_surprisal_dicts = {}
-scored_WAS = {}
-def mutual_surprisal(pair1, pair2, ngram_size=1, **kwargs):
-    if (pair1, pair2, ngram_size) in scored_WAS:
-        return scored_WAS[(pair1, pair2, ngram_size)]
-    
-    else:
-        word1, lang1 = pair1
-        word2, lang2 = pair2
+class WordPairContext:
+    def __init__(self, pair1, pair2, **kwargs):
+        """Normalizes and aligns a pair of ("word", Language) tuples once, so 
+        that the phonetic, PMI and surprisal measures of the pair can all be 
+        computed from the same alignment.
+        
+        kwargs are passed to calc_phoneme_pmi if phoneme PMI has not yet been
+        calculated for the language pair"""
+        self.pair1, self.pair2 = pair1, pair2
+        self.word1, self.lang1 = pair1
+        self.word2, self.lang2 = pair2
         
         #Remove suprasegmental diacritics
         diacritics_to_remove = list(suprasegmental_diacritics) + ['̩', '̍', ' ']
-        word1 = strip_ch(word1, diacritics_to_remove)
-        word2 = strip_ch(word2, diacritics_to_remove)
-        
-        #Calculate combined phoneme PMI if not already done
-        #pmi_dict = combine_PMI(lang1, lang2, **kwargs)
+        self.normalized1 = strip_ch(self.word1, diacritics_to_remove)
+        self.normalized2 = strip_ch(self.word2, diacritics_to_remove)
         
         #Check whether phoneme PMI has been calculated for this language pair
         #Otherwise calculate from scratch
-        if len(lang1.phoneme_pmi[lang2]) > 0:
-            pmi_dict = lang1.phoneme_pmi[lang2]
+        if len(self.lang1.phoneme_pmi[self.lang2]) > 0:
+            self.pmi_dict = self.lang1.phoneme_pmi[self.lang2]
         else:
-            pmi_dict = PhonemeCorrDetector(lang1, lang2).calc_phoneme_pmi(**kwargs)
-        
-        #Generate alignments in each direction: alignments need to come from PMI
-        alignment = phone_align(word1, word2, added_penalty_dict=pmi_dict)
+            self.pmi_dict = PhonemeCorrDetector(self.lang1, self.lang2).calc_phoneme_pmi(**kwargs)
+        self.pmi_version = self.lang1.phoneme_pmi_versions[self.lang2]
+        
+        #Align the normalized words with PMI
+        self.alignment = phone_align(self.normalized1, self.normalized2, 
+                                     added_penalty_dict=self.pmi_dict)
+        
+        #PMI alignment of the unnormalized words, only created if needed
+        self.unnormalized_alignment = None
+    
+    def phonetic_alignment(self):
+        """Returns the PMI alignment of the words without removal of 
+        suprasegmental diacritics, as used by word_sim; this is the shared 
+        alignment unless normalization changed either word"""
+        if (self.normalized1, self.normalized2) == (self.word1, self.word2):
+            return self.alignment
+        if self.unnormalized_alignment == None:
+            self.unnormalized_alignment = phone_align(self.word1, self.word2, 
+                                                      added_penalty_dict=self.pmi_dict)
+        return self.unnormalized_alignment
+    
+    def pmi_score(self, sim2dist=True, alpha=0.5):
+        """Returns the mean PMI of the aligned pair; 
+        if sim2dist == True, transformed into a distance"""
+        #Calculate PMI scores for each aligned pair
+        PMI_values = [self.pmi_dict[pair[0]][pair[1]] for pair in self.alignment]
+        PMI_score = mean(PMI_values) 
         
-        #Calculate phoneme surprisal if not already done
-        if len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0:
+        if sim2dist == True:
+            return math.exp(-max(PMI_score, 0)**alpha)
+        else:
+            return PMI_score
+    
+    def mutual_surprisal(self, ngram_size=1, **kwargs):
+        """Returns the mean word adaptation surprisal of the pair in both
+        directions, each normalized by the self-surprisal of the target word"""
+        lang1, lang2 = self.lang1, self.lang2
+        
+        #Calculate phoneme surprisal if not already done, 
+        #in both directions from the same alignments if neither has been
+        missing_l1l2 = len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0
+        missing_l2l1 = len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0
+        if missing_l1l2 and missing_l2l1:
+            PhonemeCorrDetector(lang1, lang2).calc_bidirectional_surprisal(ngram_size=ngram_size, **kwargs)
+        elif missing_l1l2:
             surprisal_dict_l1l2 = PhonemeCorrDetector(lang1, lang2).calc_phoneme_surprisal(ngram_size=ngram_size, **kwargs)
-        if len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0:
+        elif missing_l2l1:
             surprisal_dict_l2l1 = PhonemeCorrDetector(lang2, lang1).calc_phoneme_surprisal(ngram_size=ngram_size, **kwargs)
             
         #Calculate the word-adaptation surprisal in each direction
         #(note: alignment needs to be reversed to run in second direction)
-        WAS_l1l2 = adaptation_surprisal(alignment, 
+        WAS_l1l2 = adaptation_surprisal(self.alignment, 
                                         surprisal_dict=lang1.phoneme_surprisal[(lang2, ngram_size)],
                                         ngram_size=ngram_size,
                                         normalize=False)
-        WAS_l2l1 = adaptation_surprisal(reverse_alignment(alignment), 
+        WAS_l2l1 = adaptation_surprisal(reverse_alignment(self.alignment), 
                                         surprisal_dict=lang2.phoneme_surprisal[(lang1, ngram_size)],
                                         ngram_size=ngram_size,
                                         normalize=False)
         
         #Calculate self-surprisal values in each direction
-        self_surprisal1 = lang1.self_surprisal(word1, segmented=False, normalize=False) 
-        self_surprisal2 = lang2.self_surprisal(word2, segmented=False, normalize=False) 
+        self_surprisal1 = lang1.self_surprisal(self.normalized1, segmented=False, normalize=False) 
+        self_surprisal2 = lang2.self_surprisal(self.normalized2, segmented=False, normalize=False) 
         
         #Divide WAS by self-surprisal
         WAS_l1l2 /= self_surprisal2
         WAS_l2l1 /= self_surprisal1
         
-        #Return and save the average of these two values
-        mean_WAS = mean([WAS_l1l2, WAS_l2l1])
+        #Return the average of these two values
+        return mean([WAS_l1l2, WAS_l2l1])
+
+
+word_pair_contexts = {}
+max_word_pair_contexts = 100000
+def word_pair_context(pair1, pair2, **kwargs):
+    """Returns the WordPairContext of the two ("word", Language) tuples and kwargs, 
+    creating it if it does not yet exist or if the language pair's phoneme PMI 
+    has since been recalculated or reloaded"""
+    code = (pair1, pair2, tuple(f'{key}-{value}' for key, value in kwargs.items()))
+    if code in word_pair_contexts:
+        context = word_pair_contexts.pop(code)
+        if context.pmi_version == context.lang1.phoneme_pmi_versions[context.lang2]:
+            word_pair_contexts[code] = context
+            return context
+    
+    #Discard the least recently used contexts once the cache is full
+    while len(word_pair_contexts) >= max_word_pair_contexts:
+        del word_pair_contexts[next(iter(word_pair_contexts))]
+    word_pair_contexts[code] = WordPairContext(pair1, pair2, **kwargs)
+    return word_pair_contexts[code]
+
+
+combined_surprisal_dicts = {}
+scored_WAS = {}
+def mutual_surprisal(pair1, pair2, ngram_size=1, **kwargs):
+    if (pair1, pair2, ngram_size) in scored_WAS:
+        return scored_WAS[(pair1, pair2, ngram_size)]
+    
+    else:
+        #Retrieve the shared normalization and PMI alignment of the word pair
+        context = word_pair_context(pair1, pair2, **kwargs)
+        
+        #Return and save the mean word adaptation surprisal
+        mean_WAS = context.mutual_surprisal(ngram_size=ngram_size, **kwargs)
         scored_WAS[(pair1, pair2, ngram_size)] = mean_WAS
         return mean_WAS
 
@@ -409,10 +508,15 @@ def phonetic_surprisal(pair1, pair2, surprisal_dict=None, normalize=True, ngram_
     if surprisal_dict == None:
         assert (lang1 != None) and (lang2 != None)
         
-        #Calculate phoneme surprisal if not already done
-        if len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0:
+        #Calculate phoneme surprisal if not already done, 
+        #in both directions from the same alignments if neither has been
+        missing_l1l2 = len(lang1.phoneme_surprisal[(lang2, ngram_size)]) == 0
+        missing_l2l1 = len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0
+        if missing_l1l2 and missing_l2l1:
+            PhonemeCorrDetector(lang1, lang2).calc_bidirectional_surprisal(ngram_size=ngram_size)
+        elif missing_l1l2:
             surprisal_dict_l1l2 = PhonemeCorrDetector(lang1, lang2).calc_phoneme_surprisal(ngram_size=ngram_size)
-        if len(lang2.phoneme_surprisal[(lang1, ngram_size)]) == 0:
+        elif missing_l2l1:
             surprisal_dict_l2l1 = PhonemeCorrDetector(lang2, lang1).calc_phoneme_surprisal(ngram_size=ngram_size)
         
         #Take surprisal value as average of surprisal from each direction
@@ -467,42 +571,17 @@ def score_pmi(pair1, pair2, sim2dist=True, alpha=0.5, **kwargs):
         return scored_word_pmi[(pair1, pair2, sim2dist)]
     
     else:
-        word1, lang1 = pair1
-        word2, lang2 = pair2
+        #Retrieve the shared normalization and PMI alignment of the word pair
+        context = word_pair_context(pair1, pair2, **kwargs)
         
-        #Remove suprasegmental diacritics
-        diacritics_to_remove = list(suprasegmental_diacritics) + ['̩', '̍', ' ']
-        word1 = strip_ch(word1, diacritics_to_remove)
-        word2 = strip_ch(word2, diacritics_to_remove)
-        
-        #Calculate PMI in both directions if not already done, otherwise retrieve the dictionaries
-        #pmi_dict = combine_PMI(lang1, lang2, **kwargs)
-        
-        #Check whether phoneme PMI has been calculated for this language pair
-        #Otherwise calculate from scratch
-        if len(lang1.phoneme_pmi[lang2]) > 0:
-            pmi_dict = lang1.phoneme_pmi[lang2]
-        else:
-            pmi_dict = PhonemeCorrDetector(lang1, lang2).calc_phoneme_pmi(**kwargs)
-            
-        #Align the words with PMI
-        alignment = phone_align(word1, word2, added_penalty_dict=pmi_dict)
-        
-        #Calculate PMI scores for each aligned pair
-        PMI_values = [pmi_dict[pair[0]][pair[1]] for pair in alignment]
-        PMI_score = mean(PMI_values) 
-        
-        if sim2dist == True:
-            PMI_dist = math.exp(-max(PMI_score, 0)**alpha)
-            scored_word_pmi[(pair1, pair2, sim2dist)] = PMI_dist
-            return PMI_dist
-        
-        else:
-            scored_word_pmi[(pair1, pair2, sim2dist)] = PMI_score
-            return PMI_score
+        #Return and save the PMI score of the aligned pair
+        PMI_score = context.pmi_score(sim2dist=sim2dist, alpha=alpha)
+        scored_word_pmi[(pair1, pair2, sim2dist)] = PMI_score
+        return PMI_score
 
 #%%
 def LevenshteinDist(word1, word2, normalize=True, asjp=True):
+    from nltk import edit_distance
     if type(word1) == tuple:
         word1 = word1[0]
     if type(word2) == tuple:
@@ -531,9 +610,13 @@ def LevenshteinDist(word1, word2, normalize=True, asjp=True):
 hybrid_scores = {}
 def hybrid_distance(pair1, pair2, funcs, func_sims, **kwargs):
     #Try to retrieve previously calculated value if possible
-    if (pair1, pair2, tuple(funcs), tuple(weights)) in hybrid_scores:
-        return hybrid_scores[(pair1, pair2, tuple(funcs), tuple(weights))]
+    code = (pair1, pair2, tuple(funcs), tuple(func_sims), 
+            tuple(f'{key}-{value}' for key, value in kwargs.items()))
+    if code in hybrid_scores:
+        return hybrid_scores[code]
     
+    #word_sim, score_pmi and surprisal_sim each retrieve the word pair's
+    #normalization and PMI alignment from the same shared WordPairContext
     scores = []
     for func, func_sim in zip(funcs, func_sims):
         score = func(pair1, pair2, **kwargs)
@@ -541,7 +624,10 @@ def hybrid_distance(pair1, pair2, funcs, func_sims, **kwargs):
             score = 1 - score
         scores.append(score)
     
-    return euclidean_dist(scores)
+    #Save the calculated distance
+    hybrid_d = euclidean_dist(scores)
+    hybrid_scores[code] = hybrid_d
+    return hybrid_d
         
 def hybrid_similarity(pair1, pair2, **kwargs):
     hybrid_d = hybrid_distance(pair1, pair2, funcs=[word_sim, score_pmi, surprisal_sim], func_sims=[True, False, True])